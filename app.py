@@ -82,6 +82,12 @@ app.config.update(
     IGDB_API_CLIENT_ID=env.str('IGDB_API_CLIENT_ID'),
     IGDB_API_CLIENT_SECRET=env.str('IGDB_API_CLIENT_SECRET'),
 
+    # Version déployée, prise en compte dans les ETag des pages (calculée à partir des fichiers de l'application si absente)
+    DEPLOY_VERSION=env.str('DEPLOY_VERSION', default=None),
+
+    # Index des noms de jeux en mémoire (par worker) pour l'autocomplétion et la recherche de jeux à proposer
+    GAME_NAME_INDEX_ENABLED=env.bool('GAME_NAME_INDEX_ENABLED', default=False),
+
     # -----------------------------------------------------------
     # Valeurs de configuration qui ne peuvent pas être surchargées
 
@@ -90,12 +96,27 @@ app.config.update(
     USE_SESSION_FOR_NEXT=True,
 
     TOP_LAN_GAME_PROPOSALS=12,
+    TOP_LAN_GAME_PROPOSALS_CACHE_TIMEOUT=60 * 60,
+
+    SETTINGS_CACHE_POLL_INTERVAL=10,
+
+    USER_SESSION_CACHE_TIMEOUT=60 * 60,
+
+    LAN_GAME_CARD_CACHE_TIMEOUT=60 * 60 * 24,
+
+    LAN_GAME_PROPOSALS_CACHE_TIMEOUT=60 * 5,
 
     DISCORD_INTERACTIONS_PATH='/discord-interactions',
+    DISCORD_AUTOCOMPLETE_STATEMENT_TIMEOUT=1500, # Millisecondes
+    DISCORD_OUTBOX_LEASE=60 * 5,
+    DISCORD_OUTBOX_MAX_ATTEMPTS=10,
+    DISCORD_VOTES_REFRESH_DELAY=15,
+    DISCORD_INTERACTION_TOKEN_LIFETIME=60 * 15,
    
     IGDB_API_FORCED_GAMES=[
         3102, # Kerbal Space Program
     ],
+    IGDB_API_MAX_CONCURRENT_REQUESTS=4,
 )
 
 # -----------------------------------------------------------
@@ -162,6 +183,17 @@ cache = Cache(app)
 
 
 # Flask-SQLAlchemy
+try:
+    import orjson
+
+    # Désérialisation plus rapide des colonnes JSON / JSONB
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).update(
+        json_deserializer=orjson.loads
+    )
+except ImportError:
+    pass
+
+
 class AppDeclarativeBase(DeclarativeBase):
     pass
 
@@ -187,9 +219,9 @@ login_manager.login_message_category = 'error'
 
 @login_manager.user_loader
 def load_user(user_id: str):
-    from hub.models import User
+    from hub.models import UserSession
 
-    return db.session.get(User, user_id)
+    return UserSession.load(user_id)
 
 
 # -----------------------------------------------------------
@@ -197,15 +229,13 @@ def load_user(user_id: str):
 
 @app.before_request
 def before_request():
-    from hub.models import Setting
+    from hub.models import Setting, SectionStatus
 
     if request.endpoint and request.endpoint.startswith(('static', 'debugtoolbar', '_debug_toolbar')):
         return
 
-    statuses = Setting.get(['lan_games_status', 'lan_accommodations_status'])
-
-    g.lan_games_status = statuses.get('lan_games_status') or 'disabled'
-    g.lan_accommodations_status = statuses.get('lan_accommodations_status') or 'disabled'
+    g.lan_games_status = Setting.get_enum('lan_games_status', SectionStatus, SectionStatus.DISABLED)
+    g.lan_accommodations_status = Setting.get_enum('lan_accommodations_status', SectionStatus, SectionStatus.DISABLED)
 
     if request.path == app.config['DISCORD_INTERACTIONS_PATH']:
         return
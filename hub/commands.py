@@ -1,9 +1,15 @@
+from datetime import UTC, datetime
 from app import app, db, cache, discord_interactions
 from sqlalchemy.dialects import postgresql
-from typing import Dict, Optional
-from hub.models import Game
+from typing import Dict, List, Optional
+from hub.models import Game, LanGameProposal, Setting, DiscordOutboxMessage, games_staging as staging
 from rich import print_json
 import sqlalchemy as sa
+from time import time, sleep
+from itertools import islice
+from math import ceil
+import hub.discord as discord
+import asyncio
 from hub import igdb
 import click
 
@@ -28,6 +34,43 @@ def update_discord_commands() -> None:
     click.secho('Effectué', fg='green')
 
 
+@app.cli.command()
+@click.option('--once', is_flag=True, help='S\'arrête dès qu\'il n\'y a plus de message à envoyer.')
+@click.option('--interval', type=click.FloatRange(0), default=2, show_default=True, help='Délai (en secondes) entre deux vérifications de la boîte d\'envoi lorsqu\'elle est vide.')
+def discord_outbox_worker(once: bool = False, interval: float = 2) -> None:
+    """Envoie les messages Discord en attente dans la boîte d'envoi."""
+    click.echo('Envoi des messages Discord en attente...')
+
+    while True:
+        outbox_message = DiscordOutboxMessage.claim()
+
+        if not outbox_message:
+            if once:
+                break
+
+            sleep(interval)
+
+            continue
+
+        click.echo(f'  {outbox_message.type} #{outbox_message.object_id} (tentative {outbox_message.attempts})')
+
+        try:
+            discord.send_outbox_message(outbox_message)
+
+            outbox_message.complete()
+        except Exception as e:
+            db.session.rollback()
+
+            outbox_message.fail(e, discord.is_permanent_error(e))
+
+            if outbox_message.failed_at:
+                click.secho(f'  Échec définitif : {e}', fg='red')
+            else:
+                click.secho(f'  Échec : {e}', fg='red')
+
+    click.secho('Effectué', fg='green')
+
+
 @app.cli.command()
 @click.argument('resource')
 @click.option('--fields')
@@ -37,6 +80,7 @@ def update_discord_commands() -> None:
 @click.option('--offset', type=click.IntRange(0))
 @click.option('--sort')
 @click.option('--search')
+@click.option('--cache', 'use_cache', is_flag=True, help='Met en cache les réponses de l\'API et les réutilise.')
 def query_igdb(
     resource: str,
     fields: Optional[str] = None,
@@ -45,13 +89,15 @@ def query_igdb(
     limit: Optional[int] = None,
     offset: Optional[int] = None,
     sort: Optional[str] = None,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    use_cache: bool = False
 ) -> None:
     """Envoie une requête à l'API IGDB et affiche le résultat."""
     client = igdb.IgdbApiClient(
         app.config['IGDB_API_CLIENT_ID'],
         app.config['IGDB_API_CLIENT_SECRET'],
-        cache
+        cache,
+        response_cache_ttls=igdb.RESPONSE_CACHE_TTLS if use_cache else None
     )
 
     try:
@@ -121,19 +167,33 @@ def games_for_main_site() -> None:
 
 
 @app.cli.command()
-@click.option('--delete', is_flag=True)
-def update_games(delete: bool = False) -> None:
+@click.option('--delete', is_flag=True, help='Supprime les jeux qui ne sont plus sur IGDB (implique --full).')
+@click.option('--full', is_flag=True, help='Télécharge tous les jeux au lieu de ceux modifiés depuis la dernière mise à jour.')
+@click.option('--restart', is_flag=True, help='Ignore la progression d\'un précédent import interrompu.')
+@click.option('--cache', 'use_cache', is_flag=True, help='Met en cache les réponses de l\'API et les réutilise.')
+def update_games(delete: bool = False, full: bool = False, restart: bool = False, use_cache: bool = False) -> None:
     """Met à jour la base de données interne des jeux depuis IGDB."""
-    click.echo('Mise à jour des jeux depuis IGDB...')
+    limit = igdb.MAX_LIMIT
+    done_offsets = set()
+    started_at = int(time())
+    cursor = Setting.get_int('igdb_games_updated_at')
+    last_updated_at = cursor
 
-    offset = 0
-    limit = 500
-    all_game_ids = set()
+    # Les suppressions ne peuvent être détectées qu'en parcourant tout le catalogue
+    full = full or delete or not cursor
+
+    if full:
+        click.echo('Mise à jour de tous les jeux depuis IGDB...')
+    else:
+        click.echo(f'Mise à jour des jeux modifiés sur IGDB depuis le {datetime.fromtimestamp(cursor, UTC):%d/%m/%Y %H:%M:%S} UTC...')
+
+    response_cache_ttls = igdb.RESPONSE_CACHE_TTLS if use_cache else None
 
     client = igdb.IgdbApiClient(
         app.config['IGDB_API_CLIENT_ID'],
         app.config['IGDB_API_CLIENT_SECRET'],
-        cache
+        cache,
+        response_cache_ttls=response_cache_ttls
     )
 
     def get_url(game: Dict) -> Optional[str]:
@@ -248,57 +308,270 @@ def update_games(delete: bool = False) -> None:
         ]
     ])
 
+    fields = 'id, name, updated_at, total_rating_count, websites.type, websites.url, cover.image_id, multiplayer_modes.*'
+    where = f'id = ({forced_game_ids}) | (game_type = ({game_types}) & (game_status = ({game_statuses}) | game_status = null) & game_modes = ({game_modes}) & platforms = ({platforms}))'
+
+    if not full:
+        where = f'updated_at > {cursor} & ({where})'
+
+    async def fetch_and_stage(queries: List[Dict]) -> None:
+        async with igdb.AsyncIgdbApiClient(
+            app.config['IGDB_API_CLIENT_ID'],
+            app.config['IGDB_API_CLIENT_SECRET'],
+            cache,
+            rate_limiter=client.rate_limiter,
+            response_cache_ttls=response_cache_ttls,
+            max_connections=app.config['IGDB_API_MAX_CONCURRENT_REQUESTS']
+        ) as async_client:
+            async def fetch(batch: List[Dict]) -> Dict[str, List[Dict]]:
+                click.echo(f'  Téléchargement des paquets {batch[0]["offset"]} - {batch[-1]["offset"] + limit}...')
+
+                return await async_client.multiquery(batch)
+
+            batches = iter([
+                queries[i:i + igdb.MULTIQUERY_MAX_QUERIES] for i in range(0, len(queries), igdb.MULTIQUERY_MAX_QUERIES)
+            ])
+
+            # Le nombre de téléchargements en cours est borné : les paquets téléchargés ne s'accumulent ainsi pas en mémoire
+            # lorsque leur enregistrement en BDD est plus lent que leur téléchargement
+            max_pending = app.config['IGDB_API_MAX_CONCURRENT_REQUESTS']
+            pending = set()
+
+            def schedule() -> None:
+                for batch in islice(batches, max_pending - len(pending)):
+                    pending.add(asyncio.ensure_future(fetch(batch)))
+
+            try:
+                schedule()
+
+                while pending:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                    pending.difference_update(done)
+
+                    schedule()
+
+                    for task in done:
+                        # L'enregistrement en BDD est exécuté dans un thread (l'un après l'autre, la session n'étant pas
+                        # thread-safe) afin que les téléchargements se poursuivent pendant ce temps
+                        for offset, raw_games in task.result().items():
+                            await asyncio.to_thread(stage, int(offset), raw_games)
+            finally:
+                for task in pending:
+                    task.cancel()
+
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def save_checkpoint() -> None:
+        Setting.set('igdb_games_import', {
+            'where': where,
+            'total': total,
+            'started_at': started_at,
+            'last_updated_at': last_updated_at,
+            'done_offsets': sorted(done_offsets),
+        })
+
+    def stage(offset: int, raw_games: List[Dict]) -> None:
+        nonlocal last_updated_at
+
+        if raw_games:
+            last_updated_at = max(
+                last_updated_at,
+                *[game.get('updated_at', 0) for game in raw_games]
+            )
+
+            click.echo(f'  Chargement du paquet {offset} - {offset + limit} ({len(raw_games)} jeux) dans la table intermédiaire...')
+
+            driver_connection = db.session.connection().connection.driver_connection
+
+            with driver_connection.cursor() as db_cursor:
+                with db_cursor.copy(f'COPY {staging.name} (id, name, url, image_id, single_owner_enough, popularity) FROM STDIN') as copy:
+                    for game in raw_games:
+                        copy.write_row((
+                            game['id'],
+                            game['name'],
+                            get_url(game),
+                            get_image_id(game),
+                            get_single_owner_enough(game),
+                            game.get('total_rating_count', 0),
+                        ))
+
+        # Chaque paquet chargé est validé avec la progression de l'import, qui peut ainsi être repris s'il est interrompu
+        done_offsets.add(offset)
+
+        save_checkpoint()
+
+        db.session.commit()
+
+    def merge() -> int:
+        staged_count = db.session.execute(
+            sa.select(sa.func.count(sa.distinct(staging.c.id)))
+        ).scalar()
+
+        if not staged_count:
+            click.echo('Aucun jeu à mettre à jour')
+
+            return 0
+
+        click.echo(f'Mise à jour de la BDD ({staged_count} jeux)...')
+
+        # Le vecteur de recherche reste calculé par le trigger de la table
+        query = postgresql.insert(Game).from_select(
+            ['id', 'name', 'url', 'image_id', 'single_owner_enough', 'popularity'],
+            sa.select(
+                staging.c.id,
+                staging.c.name,
+                staging.c.url,
+                staging.c.image_id,
+                staging.c.single_owner_enough,
+                staging.c.popularity,
+            ).distinct(staging.c.id).order_by(staging.c.id)
+        )
+
+        # Les jeux inchangés ne sont pas réécrits (et ne sont donc pas retournés). xmax vaut 0 pour les lignes nouvellement
+        # insérées
+        inserted = db.session.execute(query.on_conflict_do_update(
+            index_elements=[Game.id],
+            set_={
+                Game.name: query.excluded.name,
+                Game.url: query.excluded.url,
+                Game.image_id: query.excluded.image_id,
+                Game.single_owner_enough: query.excluded.single_owner_enough,
+                Game.popularity: query.excluded.popularity,
+            },
+            where=sa.or_(
+                Game.name.is_distinct_from(query.excluded.name),
+                Game.url.is_distinct_from(query.excluded.url),
+                Game.image_id.is_distinct_from(query.excluded.image_id),
+                Game.single_owner_enough.is_distinct_from(query.excluded.single_owner_enough),
+                Game.popularity.is_distinct_from(query.excluded.popularity),
+            )
+        ).returning(sa.literal_column('xmax = 0', sa.Boolean))).scalars().all()
+
+        inserted_count = inserted.count(True)
+        updated_count = len(inserted) - inserted_count
+
+        click.echo(f'  {inserted_count} ajoutés, {updated_count} modifiés, {staged_count - len(inserted)} inchangés')
+
+        return len(inserted)
+
+    total = client.count('games', where=where)
+
+    click.echo(f'  {total} jeux à télécharger')
+
+    # Les jeux reçus sont chargés via COPY dans une table intermédiaire, puis fusionnés en une seule requête. Elle sert
+    # aussi à déterminer les jeux à supprimer. Son contenu est conservé d'une exécution à l'autre pour pouvoir reprendre
+    # un import interrompu, à condition que les critères de recherche et le nombre de jeux n'aient pas changé (les
+    # paquets étant définis par leur position)
+    checkpoint = None if restart else Setting.get('igdb_games_import')
+
+    if checkpoint and (checkpoint['where'] != where or checkpoint['total'] != total):
+        click.secho('  Les critères ou le catalogue IGDB ont changé depuis l\'import interrompu, reprise impossible', fg='yellow')
+
+        checkpoint = None
+
+    if checkpoint:
+        started_at = checkpoint['started_at']
+        last_updated_at = checkpoint['last_updated_at']
+        done_offsets.update(checkpoint['done_offsets'])
+
+        click.echo(f'  Reprise de l\'import interrompu ({len(done_offsets)} paquets déjà chargés)')
+    else:
+        db.session.execute(sa.text(f'TRUNCATE {staging.name}'))
+
+        save_checkpoint()
+
+        db.session.commit()
+
+    # Le tri par ID garantit que les paquets ne se chevauchent pas alors qu'ils sont téléchargés dans le désordre
+    queries = [
+        {
+            'resource': 'games',
+            'name': str(offset),
+            'fields': fields,
+            'where': where,
+            'sort': 'id asc',
+            'limit': limit,
+            'offset': offset,
+        } for offset in range(0, total, limit) if offset not in done_offsets
+    ]
+
+    # Les paquets sont téléchargés en parallèle (plusieurs paquets par requête grâce au endpoint multiquery) et enregistrés
+    # au fur et à mesure de leur arrivée
+    if queries:
+        asyncio.run(fetch_and_stage(queries))
+
+    # Récupère les éventuels jeux ajoutés sur IGDB depuis le comptage
+    offset = ceil(total / limit) * limit
+
     while True:
+        if offset in done_offsets:
+            offset += limit
+
+            continue
+
         click.echo(f'  Téléchargement du paquet {offset} - {offset + limit}...')
 
         raw_games = client.call(
             'games',
-            fields='id, name, websites.type, websites.url, cover.image_id, multiplayer_modes.*',
-            where=f'id = ({forced_game_ids}) | (game_type = ({game_types}) & (game_status = ({game_statuses}) | game_status = null) & game_modes = ({game_modes}) & platforms = ({platforms}))',
+            fields=fields,
+            where=where,
             offset=offset,
             limit=limit,
+            sort='id asc',
         )
 
         if not raw_games:
             break
 
-        games = [
-            {
-                'id': game['id'],
-                'name': game['name'],
-                'url': get_url(game),
-                'image_id': get_image_id(game),
-                'single_owner_enough': get_single_owner_enough(game),
-            } for game in raw_games
-        ]
+        stage(offset, raw_games)
 
-        query = postgresql.insert(Game).values(games)
+        offset += limit
 
-        click.echo('  Mise à jour de la BDD...')
+    changed_count = merge()
 
-        all_game_ids.update([
-            str(game['id']) for game in games
-        ])
+    if delete:
+        click.echo('Suppression des anciens jeux...')
 
-        db.session.execute(query.on_conflict_do_update(
-            index_elements=[Game.id],
-            set_={
-                Game.name: query.excluded.name,
-                Game.url: query.excluded.url,
-                Game.image_id: query.excluded.image_id,
-                Game.single_owner_enough: query.excluded.single_owner_enough,
-            }
-        ))
+        # Par sécurité, rien n'est supprimé si aucun jeu n'a été reçu
+        if db.session.execute(sa.select(sa.exists().select_from(staging))).scalar():
+            deleted_count = db.session.execute(
+                sa.delete(Game).where(
+                    ~sa.exists().where(staging.c.id == Game.id)
+                ).execution_options(synchronize_session=False)
+            ).rowcount
 
-        offset += limit
+            click.echo(f'  {deleted_count} jeux supprimés')
 
-    if delete:
-        click.echo('Suppression des anciens jeux...')
+            changed_count += deleted_count
+        else:
+            click.secho('  Aucun jeu reçu, suppression annulée', fg='yellow')
 
-        db.session.execute(
-            sa.text(f'DELETE FROM {Game.__tablename__} WHERE id NOT IN ({",".join(all_game_ids)});')
-        )
+    # Un jeu modifié sur IGDB pendant la mise à jour, après le téléchargement de son paquet, ne doit pas être ignoré
+    # par la prochaine mise à jour incrémentale : le curseur ne dépasse donc jamais le début de celle-ci
+    if last_updated_at:
+        Setting.set('igdb_games_updated_at', min(last_updated_at, started_at))
+
+    # Signale aux index des noms de jeux des workers que le catalogue a changé
+    if changed_count:
+        Setting.set('games_catalogue_version', int(time()))
+
+    Setting.delete('igdb_games_import')
+
+    db.session.execute(sa.text(f'TRUNCATE {staging.name}'))
 
     db.session.commit()
 
+    # Les propositions des jeux supprimés l'ont été en cascade
+    if delete:
+        LanGameProposal.forget_game_ids()
+
+    # Le classement affiche le nom des jeux proposés
+    if changed_count:
+        LanGameProposal.forget_top()
+
+    stats = client.rate_limiter.stats
+
+    click.echo(f'{stats["calls"]} requêtes IGDB, dont {stats["waited_calls"]} limitées ({stats["total_wait"]:.1f} s d\'attente au total, {stats["max_wait"]:.2f} s au maximum)')
+
     click.secho('Effectué', fg='green')
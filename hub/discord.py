@@ -1,18 +1,22 @@
 from flask_babel import format_currency
 
-from hub.models import User, Game, VoteType, LanGameProposal, LanGameProposalVote, LanAccommodationProposal, LanAccommodationProposalVote
+from hub.models import User, Game, VoteType, LanGameProposal, LanGameProposalVote, LanAccommodationProposal, LanAccommodationProposalVote, DiscordOutboxMessage, DiscordOutboxMessageType, VotableMixin, VoteTally, game_name_index
 from flask_discord_interactions import Message, Embed, ActionRow, ButtonStyles, Button, Context, Autocomplete, Option
 from flask_discord_interactions.models.embed import Media, Field, Footer
-from sqlalchemy_searchable import search, inspect_search_vectors
-from app import app, db, discord_interactions
-from sqlalchemy.dialects import postgresql
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func as sa_func
-from typing import Dict, Literal, List
+from app import app, db, cache, discord_interactions
+from sqlalchemy.exc import IntegrityError, OperationalError
+from typing import Dict, Literal, List, Optional, Iterator, Union, Callable
 from flask import url_for, session, g
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+from hub.locks import cache_lock
+from requests import Response, Session
+from requests.exceptions import HTTPError
 from urllib.parse import urlencode
-from requests import Response
+from flask_caching import Cache
 import sqlalchemy.orm as sa_orm
+from time import time, sleep
+from threading import Lock
 import sqlalchemy as sa
 import requests
 import secrets
@@ -29,9 +33,173 @@ SCOPES = (
 
 API_BASE_URL = 'https://discord.com/api'
 
+API_CONNECT_TIMEOUT = 5
+API_READ_TIMEOUT = 15
+API_MAX_RETRIES = 3
+API_ERROR_THREAD_ALREADY_CREATED = 160004
+
+# Durée supposée de la période d'un bucket qui vient d'être réinitialisé, en attendant qu'une réponse donne la vraie
+API_BUCKET_PROVISIONAL_PERIOD = 1
+API_BUCKET_STATE_TIMEOUT = 60 * 60
+
+# Paramètres "majeurs" d'une route : les limites de débit d'un même bucket sont distinctes pour chacune de leurs valeurs
+API_MAJOR_PARAMETERS = ('channel_id', 'guild_id', 'webhook_id')
+
 EMBEDS_COLOR = 0xf56b3d
 
 
+class DiscordApiClient:
+    """Client de l'API REST de Discord, authentifié en tant que bot.
+
+    Les limites de débit annoncées par Discord dans les en-têtes `X-RateLimit-*` sont enregistrées dans le cache, par
+    bucket et par paramètre majeur, afin d'être partagées par tous les processus : les requêtes sont retardées plutôt que
+    d'atteindre ces limites. Les réponses 429 sont réessayées après le délai `retry_after` indiqué par Discord.
+
+    Les accès concurrents aux limites sont sérialisés par un verrou local au processus, doublé d'un verrou posé dans le
+    cache (voir cache_lock())."""
+    _local_lock = Lock()
+
+    def __init__(
+        self,
+        cache: Cache,
+        max_retries: int = API_MAX_RETRIES,
+        connect_timeout: float = API_CONNECT_TIMEOUT,
+        read_timeout: float = API_READ_TIMEOUT,
+        max_connections: int = 10
+    ) -> None:
+        self.cache = cache
+        self.max_retries = max_retries
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=max_connections))
+        self.session.headers.update({
+            'Accept': 'application/json',
+        })
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        with self._local_lock, cache_lock(self.cache, 'discord_api_client.lock'):
+            yield
+
+    @staticmethod
+    def route_key(method: str, route: str, params: Dict) -> str:
+        """Identifiant d'une route tel que Discord le conçoit : méthode HTTP, chemin et valeurs des paramètres majeurs."""
+        major = ':'.join(str(params[name]) for name in API_MAJOR_PARAMETERS if name in params)
+
+        return f'{method} {route} {major}'
+
+    def _bucket_key(self, route_key: str) -> str:
+        # Plusieurs routes peuvent partager un même bucket, qui n'est connu qu'après une première réponse de Discord
+        bucket = self.cache.get(f'discord_api_client.routes.{route_key}')
+
+        if bucket:
+            return f'discord_api_client.buckets.{bucket}.{route_key.rsplit(" ", 1)[1]}'
+
+        return f'discord_api_client.buckets.{route_key}'
+
+    def _acquire(self, route_key: str) -> None:
+        """Attend que la route, et l'API dans son ensemble, puissent de nouveau être appelées puis réserve un appel."""
+        while True:
+            with self._lock():
+                now = time()
+
+                blocked_until = self.cache.get('discord_api_client.global') or 0.0
+                bucket_key = self._bucket_key(route_key)
+                remaining, reset_at, limit = self.cache.get(bucket_key) or (1, 0.0, 1)
+
+                if now >= reset_at:
+                    # Le bucket (ou un bucket encore inconnu, limité à un appel à la fois) est de nouveau plein, jusqu'à
+                    # ce qu'une réponse indique la fin de la nouvelle période
+                    remaining, reset_at = limit, now + API_BUCKET_PROVISIONAL_PERIOD
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif remaining > 0:
+                    self.cache.set(bucket_key, (remaining - 1, reset_at, limit), timeout=API_BUCKET_STATE_TIMEOUT)
+
+                    wait = 0.0
+                else:
+                    wait = reset_at - now
+
+            if not wait:
+                break
+
+            sleep(wait)
+
+    def _update(self, route_key: str, response: Response) -> None:
+        """Enregistre les limites de débit annoncées par Discord dans la réponse."""
+        with self._lock():
+            now = time()
+
+            bucket = response.headers.get('X-RateLimit-Bucket')
+
+            if bucket:
+                self.cache.set(f'discord_api_client.routes.{route_key}', bucket, timeout=60 * 60 * 24)
+
+            bucket_key = self._bucket_key(route_key)
+            _, _, limit = self.cache.get(bucket_key) or (1, 0.0, 1)
+
+            if 'X-RateLimit-Limit' in response.headers:
+                limit = int(response.headers['X-RateLimit-Limit'])
+
+            if response.status_code == 429:
+                retry_after = self.retry_after(response)
+
+                if response.headers.get('X-RateLimit-Global') or response.headers.get('X-RateLimit-Scope') == 'global':
+                    self.cache.set('discord_api_client.global', now + retry_after, timeout=int(retry_after) + 1)
+
+                    return
+
+                remaining, reset_after = 0, retry_after
+            elif 'X-RateLimit-Remaining' in response.headers and 'X-RateLimit-Reset-After' in response.headers:
+                remaining = int(response.headers['X-RateLimit-Remaining'])
+                reset_after = float(response.headers['X-RateLimit-Reset-After'])
+            else:
+                return
+
+            self.cache.set(bucket_key, (remaining, now + reset_after, limit), timeout=API_BUCKET_STATE_TIMEOUT)
+
+    @staticmethod
+    def retry_after(response: Response) -> float:
+        """Délai avant de réessayer, en secondes, d'après une réponse 429. Celles émises en amont de l'API (par Cloudflare
+        notamment) ne sont pas forcément en JSON."""
+        try:
+            return float(response.json()['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            pass
+
+        try:
+            return float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            return 1.0
+
+    def request(self, method: str, route: str, params: Optional[Dict] = None, authenticated: bool = True, **kwargs) -> Response:
+        """Appelle la route donnée (par exemple `/channels/{channel_id}/messages`) de l'API. Les routes des webhooks
+        d'interaction ne sont pas `authenticated`. Les autres arguments sont passés tels quels à requests."""
+        params = params or {}
+        route_key = self.route_key(method, route, params)
+
+        if authenticated:
+            kwargs.setdefault('headers', {})['Authorization'] = 'Bot {DISCORD_BOT_TOKEN}'.format(**app.config)
+        kwargs.setdefault('timeout', self.timeout)
+
+        for _ in range(self.max_retries + 1):
+            self._acquire(route_key)
+
+            response = self.session.request(method, API_BASE_URL + route.format(**params), **kwargs)
+
+            self._update(route_key, response)
+
+            if response.status_code != 429:
+                break
+
+        return response
+
+
+api_client = DiscordApiClient(cache)
+
+
 def generate_authorize_url() -> str:
     session['oauth2_state'] = secrets.token_urlsafe(16)
 
@@ -55,7 +223,8 @@ def get_oauth_token(code: str) -> Response:
             'code': code,
             'grant_type': 'authorization_code',
             'redirect_uri': url_for('login_callback', _external=True, _scheme=app.config['PREFERRED_URL_SCHEME']),
-        }
+        },
+        timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
     )
 
 
@@ -64,7 +233,8 @@ def get_membership_info(token: Dict) -> Response:
         '{API_BASE_URL}/users/@me/guilds/{DISCORD_GUILD_ID}/member'.format(API_BASE_URL=API_BASE_URL, **app.config),
         headers={
             'Authorization': '{token_type} {access_token}'.format(**token),
-        }
+        },
+        timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
     )
 
 
@@ -76,6 +246,75 @@ def can_send_organizer_messages() -> bool:
     return app.config['DISCORD_BOT_TOKEN'] and app.config['DISCORD_LAN_ORGANIZER_CHANNEL_ID']
 
 
+def _defer(ctx: Context, f: Callable[..., Message], *args, ephemeral: bool = False) -> Message:
+    """Répond immédiatement à l'interaction par une réponse différée (Discord affiche alors que le bot réfléchit). `f`
+    est ensuite exécutée par la commande discord_outbox_worker : le message qu'elle retourne remplace alors la réponse
+    différée. Discord exige en effet une réponse sous trois secondes, ce que les accès à la BDD ne permettent pas
+    toujours de garantir.
+
+    `f` doit figurer dans DEFERRED_HANDLERS, et ses arguments être sérialisables en JSON."""
+    DiscordOutboxMessage.enqueue(
+        DiscordOutboxMessageType.INTERACTION_RESPONSE,
+        int(ctx.id),
+        payload={
+            'token': ctx.token,
+            'handler': f.__name__,
+            'args': args,
+            'lan_games_status': g.lan_games_status,
+            'lan_accommodations_status': g.lan_accommodations_status,
+        }
+    )
+
+    db.session.commit()
+
+    return Message(
+        deferred=True,
+        ephemeral=ephemeral
+    )
+
+
+def _respond_to_interaction(outbox_message: DiscordOutboxMessage) -> None:
+    """Exécute le traitement différé d'une interaction puis remplace la réponse différée par son résultat."""
+    payload = outbox_message.payload
+
+    # Le résultat est conservé afin que le traitement ne soit pas exécuté à nouveau si la réponse doit être réessayée
+    if 'response' not in payload:
+        g.lan_games_status = payload['lan_games_status']
+        g.lan_accommodations_status = payload['lan_accommodations_status']
+
+        try:
+            message = DEFERRED_HANDLERS[payload['handler']](*payload['args'])
+        except Exception:
+            db.session.rollback()
+
+            app.logger.exception('Impossible de traiter l\'interaction Discord')
+
+            message = Message('Oups, une erreur est survenue. Réessaye dans quelques instants.')
+
+        data, content_type = message.encode(followup=True)
+
+        outbox_message.payload = {
+            **payload,
+            'response': data.decode() if isinstance(data, bytes) else data,
+            'content_type': content_type,
+        }
+
+        db.session.commit()
+
+        payload = outbox_message.payload
+
+    api_client.request(
+        'PATCH',
+        '/webhooks/{webhook_id}/{webhook_token}/messages/@original',
+        {'webhook_id': app.config['DISCORD_CLIENT_ID'], 'webhook_token': payload['token']},
+        authenticated=False,
+        data=payload['response'],
+        headers={
+            'Content-Type': payload['content_type'],
+        }
+    ).raise_for_status()
+
+
 def _handle_top_games(ctx: Context) -> Message:
     if g.lan_games_status == 'disabled':
         return Message(
@@ -83,25 +322,42 @@ def _handle_top_games(ctx: Context) -> Message:
             ephemeral=True
         )
 
-    proposals = db.session.execute(
-        sa.select(LanGameProposal)
-        .options(
-            sa_orm.selectinload(LanGameProposal.game),
-            sa_orm.selectinload(LanGameProposal.votes)
-        )
-    ).scalars().all()
+    # Seul le calcul du top est différé : s'il est déjà en cache, il est retourné immédiatement
+    message = cache.get(_top_games_cache_key())
+
+    if message is not None:
+        return message
 
-    lan_participants_count = db.session.execute(
-        sa.select(sa_func.count('*')).select_from(User)
-        .where(User.is_lan_participant == True)
-    ).scalar()
+    return _defer(ctx, _top_games_message)
 
-    for proposal in proposals:
-        proposal.is_essential = proposal.votes_count(VoteType.YES) == lan_participants_count
 
-    proposals.sort(key=lambda p: p.score, reverse=True)
+def _top_games_cache_key() -> str:
+    # Le top n'est recalculé que lorsque les propositions, leurs votes ou les participants ont changé
+    return f'discord.top_games.{LanGameProposal.top_version()}'
 
-    proposals = proposals[:app.config['TOP_LAN_GAME_PROPOSALS']]
+
+def _top_games_message() -> Message:
+    # La version est lue avant le calcul : un top calculé pendant une modification est enregistré sous l'ancienne
+    cache_key = _top_games_cache_key()
+
+    message = cache.get(cache_key)
+
+    if message is None:
+        message = _render_top_games_message()
+
+        cache.set(cache_key, message, timeout=app.config['TOP_LAN_GAME_PROPOSALS_CACHE_TIMEOUT'])
+
+    return message
+
+
+def _render_top_games_message() -> Message:
+    tallies = LanGameProposal.tally(
+        LanGameProposal.tally_query(voters=User.is_lan_participant == True)
+        .options(
+            sa_orm.selectinload(LanGameProposal.game)
+        )
+        .limit(app.config['TOP_LAN_GAME_PROPOSALS'])
+    )
 
     return Message(
         'Voici le **top {TOP_LAN_GAME_PROPOSALS}** actuel des jeux proposés :'.format(**app.config),
@@ -110,17 +366,12 @@ def _handle_top_games(ctx: Context) -> Message:
             fields=[
                 Field(
                     name='{}{}'.format(
-                        '⭐️ ' if proposal.is_essential else '',
-                        proposal.game.name
+                        '⭐️ ' if tally.is_essential else '',
+                        tally.proposal.game.name
                     ),
-                    value='  '.join([
-                        '{} {}'.format(
-                            _vote_type_emoji(vote_type),
-                            proposal.votes_count(vote_type),
-                        ) for vote_type in VoteType
-                    ]),
+                    value=_votes_counts(tally),
                     inline=True
-                ) for proposal in proposals
+                ) for tally in tallies
             ]
         ),
         components=[
@@ -165,8 +416,12 @@ def _handle_game_vote_button(ctx: Context, game_id: int, vote_type: Literal['YES
         try:
             LanGameProposalVote.vote(user, game_id, VoteType(vote_type))
 
+            refresh_game_proposal_votes(game_id)
+
             db.session.commit()
 
+            LanGameProposal.forget_top()
+
             message = 'A voté !'
         except ValueError:
             message = 'Type de vote invalide.'
@@ -224,7 +479,11 @@ def _handle_accommodation_vote_button(ctx: Context, accommodation_proposal_id: i
     }
 )
 def submit_game_proposal_command(ctx: Context, jeu: Autocomplete(int)) -> Message:
-    user = db.session.get(User, ctx.author.id)
+    return _defer(ctx, _submit_game_proposal, int(ctx.author.id), jeu, ephemeral=True)
+
+
+def _submit_game_proposal(user_id: int, jeu: int) -> Message:
+    user = db.session.get(User, user_id)
 
     if not user:
         message = 'Tu n\'a pas encore de compte sur notre intranet. Crée-le ici {} et rééssaye. Tu peux également proposer ici {}.'.format(
@@ -251,15 +510,18 @@ def submit_game_proposal_command(ctx: Context, jeu: Autocomplete(int)) -> Messag
 
             LanGameProposalVote.vote(user, jeu, VoteType.YES)
 
+            if can_send_lan_messages():
+                DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.GAME_PROPOSAL, jeu)
+
             db.session.commit()
 
-            if can_send_lan_messages():
-                send_game_proposal_message(
-                    db.session.get(LanGameProposal, jeu)
-                )
+            LanGameProposal.forget_game_ids()
+            LanGameProposal.forget_top()
 
             message = 'Merci pour ta proposition !'
         except IntegrityError:
+            db.session.rollback()
+
             message = 'Ce jeu a déjà été proposé (ou identifiant de jeu invalide).'
 
     return Message(
@@ -273,21 +535,29 @@ def submit_game_proposal_command_autocomplete(ctx: Context, jeu: Option = None)
     if not jeu or not jeu.focused or not jeu.value:
         return []
 
-    games = db.session.execute(
-        search(
-            sa.select(Game.id, Game.name)
+    if app.config['GAME_NAME_INDEX_ENABLED']:
+        return [
+            {
+                'value': game_id,
+                'name': name
+            } for game_id, name in game_name_index.search(jeu.value, exclude=LanGameProposal.game_ids())
+        ]
+
+    try:
+        # Discord abandonne l'autocomplétion au bout de trois secondes : inutile de laisser la requête durer davantage
+        db.session.execute(
+            sa.text(f'SET LOCAL statement_timeout = {app.config["DISCORD_AUTOCOMPLETE_STATEMENT_TIMEOUT"]}')
+        )
+
+        games = db.session.execute(
+            Game.autocomplete_query(jeu.value)
             .outerjoin(LanGameProposal)
             .filter(LanGameProposal.game_id == None)
-            .limit(25)
-            .order_by(
-                sa.desc(
-                    sa.func.ts_rank_cd(inspect_search_vectors(Game)[0], sa.func.parse_websearch(jeu.value), 2)
-                )
-            ),
-            jeu.value,
-            regconfig=sa.cast('english_nostop', postgresql.REGCONFIG)
-        )
-    ).all()
+        ).all()
+    except OperationalError:
+        db.session.rollback()
+
+        return []
 
     return [
         {
@@ -305,6 +575,59 @@ def top_games_command(ctx: Context) -> Message:
     return _handle_top_games(ctx)
 
 
+# Traitements pouvant être différés par _defer()
+DEFERRED_HANDLERS = {
+    f.__name__: f for f in (
+        _top_games_message,
+        _submit_game_proposal,
+    )
+}
+
+
+def send_outbox_message(outbox_message: DiscordOutboxMessage) -> None:
+    """Envoie (ou met à jour) le message Discord correspondant à un message de la boîte d'envoi. Les objets supprimés
+    depuis sont ignorés."""
+    if outbox_message.type == DiscordOutboxMessageType.INTERACTION_RESPONSE:
+        _respond_to_interaction(outbox_message)
+    elif outbox_message.type == DiscordOutboxMessageType.GAME_PROPOSAL:
+        game_proposal = db.session.get(LanGameProposal, outbox_message.object_id)
+
+        if game_proposal and can_send_lan_messages():
+            send_game_proposal_message(game_proposal)
+    elif outbox_message.type == DiscordOutboxMessageType.GAME_PROPOSAL_VOTES:
+        game_proposal = db.session.get(LanGameProposal, outbox_message.object_id)
+
+        # Le message n'est mis à jour que s'il a déjà été envoyé
+        if game_proposal and game_proposal.message_id and can_send_lan_messages():
+            send_game_proposal_message(game_proposal)
+    elif outbox_message.type == DiscordOutboxMessageType.GAME_PROPOSAL_THREAD:
+        game_proposal = db.session.get(LanGameProposal, outbox_message.object_id)
+
+        if game_proposal and game_proposal.message_id and can_send_lan_messages():
+            _start_thread_once(app.config['DISCORD_LAN_CHANNEL_ID'], game_proposal.message_id, game_proposal.game.name)
+    elif outbox_message.type == DiscordOutboxMessageType.ACCOMMODATION_PROPOSAL:
+        accommodation_proposal = db.session.get(LanAccommodationProposal, outbox_message.object_id)
+
+        if accommodation_proposal and can_send_organizer_messages():
+            send_accommodation_proposal_message(accommodation_proposal)
+    elif outbox_message.type == DiscordOutboxMessageType.ACCOMMODATION_PROPOSAL_THREAD:
+        accommodation_proposal = db.session.get(LanAccommodationProposal, outbox_message.object_id)
+
+        if accommodation_proposal and accommodation_proposal.message_id and can_send_organizer_messages():
+            _start_thread_once(app.config['DISCORD_LAN_ORGANIZER_CHANNEL_ID'], accommodation_proposal.message_id, accommodation_proposal.title)
+
+
+def refresh_game_proposal_votes(game_id: int) -> None:
+    """Programme la mise à jour des votes affichés dans le message Discord d'une proposition de jeu. Les votes reçus
+    dans les `DISCORD_VOTES_REFRESH_DELAY` secondes sont regroupés en une seule mise à jour."""
+    if can_send_lan_messages():
+        DiscordOutboxMessage.enqueue(
+            DiscordOutboxMessageType.GAME_PROPOSAL_VOTES,
+            game_id,
+            delay=app.config['DISCORD_VOTES_REFRESH_DELAY']
+        )
+
+
 def send_game_proposal_message(game_proposal: LanGameProposal) -> None:
     components = [
         Button(
@@ -333,6 +656,7 @@ def send_game_proposal_message(game_proposal: LanGameProposal) -> None:
         f'**{game_proposal.user.display_name}** a proposé un nouveau jeu :',
         embed=Embed(
             title=game_proposal.game.name,
+            description=_votes_counts(game_proposal),
             color=EMBEDS_COLOR,
             url=game_proposal.game.url,
             image=Media(game_proposal.game.image_url),
@@ -346,21 +670,22 @@ def send_game_proposal_message(game_proposal: LanGameProposal) -> None:
     ).encode(True)
 
     if game_proposal.message_id:
-        _update_message(app.config['DISCORD_LAN_CHANNEL_ID'], game_proposal.message_id, data, content_type)
+        _update_message(app.config['DISCORD_LAN_CHANNEL_ID'], game_proposal.message_id, data, content_type).raise_for_status()
     else:
-        message_id = _send_message(app.config['DISCORD_LAN_CHANNEL_ID'], data, content_type).json().get('id')
+        response = _send_message(app.config['DISCORD_LAN_CHANNEL_ID'], data, content_type)
+
+        response.raise_for_status()
+
+        message_id = response.json().get('id')
 
         game_proposal.message_id = message_id
 
         db.session.add(game_proposal)
 
-        db.session.commit()
+        # Le fil est créé séparément afin d'être réessayé seul en cas d'échec
+        DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.GAME_PROPOSAL_THREAD, game_proposal.game_id)
 
-        _start_thread(
-            app.config['DISCORD_LAN_CHANNEL_ID'],
-            message_id,
-            game_proposal.game.name
-        )
+        db.session.commit()
 
 
 def send_accommodation_proposal_message(accommodation_proposal: LanAccommodationProposal) -> None:
@@ -455,57 +780,94 @@ def send_accommodation_proposal_message(accommodation_proposal: LanAccommodation
     ).encode(True)
 
     if accommodation_proposal.message_id:
-        _update_message(app.config['DISCORD_LAN_ORGANIZER_CHANNEL_ID'], accommodation_proposal.message_id, data, content_type)
+        _update_message(app.config['DISCORD_LAN_ORGANIZER_CHANNEL_ID'], accommodation_proposal.message_id, data, content_type).raise_for_status()
     else:
-        message_id = _send_message(app.config['DISCORD_LAN_ORGANIZER_CHANNEL_ID'], data, content_type).json().get('id')
+        response = _send_message(app.config['DISCORD_LAN_ORGANIZER_CHANNEL_ID'], data, content_type)
+
+        response.raise_for_status()
+
+        message_id = response.json().get('id')
 
         accommodation_proposal.message_id = message_id
 
         db.session.add(accommodation_proposal)
 
-        db.session.commit()
+        # Le fil est créé séparément afin d'être réessayé seul en cas d'échec
+        DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.ACCOMMODATION_PROPOSAL_THREAD, accommodation_proposal.id)
 
-        _start_thread(
-            app.config['DISCORD_LAN_ORGANIZER_CHANNEL_ID'],
-            message_id,
-            accommodation_proposal.title
-        )
+        db.session.commit()
 
 
 def _send_message(channel_id: int, data: Dict, content_type: str) -> Response:
-    return requests.post(
-        '{API_BASE_URL}/channels/{channel_id}/messages'.format(API_BASE_URL=API_BASE_URL, channel_id=channel_id, **app.config),
+    return api_client.request(
+        'POST',
+        '/channels/{channel_id}/messages',
+        {'channel_id': channel_id},
         data=data,
         headers={
             'Content-Type': content_type,
-            'Authorization': 'Bot {DISCORD_BOT_TOKEN}'.format(**app.config),
         }
     )
 
 
 def _update_message(channel_id: int, message_id: int, data: Dict, content_type: str) -> Response:
-    return requests.patch(
-        '{API_BASE_URL}/channels/{channel_id}/messages/{message_id}'.format(API_BASE_URL=API_BASE_URL, channel_id=channel_id, message_id=message_id, **app.config),
+    return api_client.request(
+        'PATCH',
+        '/channels/{channel_id}/messages/{message_id}',
+        {'channel_id': channel_id, 'message_id': message_id},
         data=data,
         headers={
             'Content-Type': content_type,
-            'Authorization': 'Bot {DISCORD_BOT_TOKEN}'.format(**app.config),
         }
     )
 
 
 def _start_thread(channel_id: int, message_id: int, name: str) -> Response:
-    return requests.post(
-        '{API_BASE_URL}/channels/{channel_id}/messages/{message_id}/threads'.format(API_BASE_URL=API_BASE_URL, channel_id=channel_id, message_id=message_id, **app.config),
+    return api_client.request(
+        'POST',
+        '/channels/{channel_id}/messages/{message_id}/threads',
+        {'channel_id': channel_id, 'message_id': message_id},
         json={
             'name': name,
-        },
-        headers={
-            'Authorization': 'Bot {DISCORD_BOT_TOKEN}'.format(**app.config),
         }
     )
 
 
+def _votes_counts(votable: Union[VotableMixin, VoteTally]) -> str:
+    return '  '.join([
+        '{} {}'.format(
+            _vote_type_emoji(vote_type),
+            votable.votes_count(vote_type),
+        ) for vote_type in VoteType
+    ])
+
+
+def _start_thread_once(channel_id: int, message_id: int, name: str) -> None:
+    """Crée le fil d'un message, sauf s'il existe déjà (tentative précédente dont la réponse a été perdue)."""
+    response = _start_thread(channel_id, message_id, name)
+
+    if response.status_code == 400 and _error_code(response) == API_ERROR_THREAD_ALREADY_CREATED:
+        return
+
+    response.raise_for_status()
+
+
+def _error_code(response: Response) -> Optional[int]:
+    try:
+        return response.json().get('code')
+    except ValueError:
+        return None
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """Indique si une erreur de l'API Discord ne se résoudra pas d'elle-même (message supprimé, permissions
+    manquantes, données invalides...) : les erreurs 4xx, sauf 429."""
+    return isinstance(error, HTTPError) \
+        and error.response is not None \
+        and 400 <= error.response.status_code < 500 \
+        and error.response.status_code != 429
+
+
 def _vote_type_emoji(vote_type: VoteType) -> str:
     if vote_type == vote_type.YES:
         return '👍'
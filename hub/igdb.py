@@ -1,14 +1,42 @@
-from ratelimit import limits, sleep_and_retry
 from requests.exceptions import HTTPError
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Union, Iterator, Any
+from contextlib import contextmanager
+from hub.locks import cache_lock
 from flask_caching import Cache
+from time import time, sleep
+from threading import Lock
 from enum import IntEnum
 import requests
+import asyncio
+import hashlib
+import random
+import httpx
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 requests = requests.Session()
 
 API_BASE_URL = 'https://api.igdb.com/v4/'
 OAUTH2_TOKEN_ENDPOINT = 'https://id.twitch.tv/oauth2/token'
+MULTIQUERY_MAX_QUERIES = 10
+MAX_LIMIT = 500
+RATE_LIMIT_CALLS = 4
+RATE_LIMIT_PERIOD = 1
+MAX_RETRIES = 3
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+
+# Durées de conservation en cache des réponses de l'API, par ressource (lorsque le cache des réponses est activé)
+RESPONSE_CACHE_TTLS = {
+    'games': 60 * 60,
+    'games/count': 60 * 10,
+    'multiquery': 60 * 60,
+}
+RESPONSE_CACHE_DEFAULT_TTL = 60 * 15
+RESPONSE_CACHE_MAX_SIZE = 2 * 1024 * 1024 # Les réponses plus volumineuses (en octets) ne sont pas mises en cache
 
 
 class GameType(IntEnum):
@@ -86,14 +114,117 @@ class IgdbApiErrorResponse(Exception):
         super().__init__(f'[{code}] {message}\nURL: {url}\nBody: {body}')
 
 
+class RateLimiter:
+    """Limiteur de débit de type "token bucket", dont l'état est stocké dans le cache afin d'être partagé par tous les
+    clients (et tous les processus) utilisant le même identifiant client IGDB.
+
+    Les accès concurrents à l'état sont sérialisés par un verrou local au processus, doublé d'un verrou posé dans le
+    cache (voir cache_lock())."""
+    _local_lock = Lock()
+
+    def __init__(
+        self,
+        cache: Cache,
+        name: str,
+        calls: int = RATE_LIMIT_CALLS,
+        period: float = RATE_LIMIT_PERIOD,
+        burst: int = 1
+    ) -> None:
+        self.cache = cache
+        self.cache_key = f'igdb_api_client.rate_limiter.{name}'
+        self.capacity = burst # Une rafale de plus d'un appel permettrait de dépasser la limite sur une fenêtre glissante
+        self.rate = calls / period
+
+        self.calls = 0
+        self.waited_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        with self._local_lock, cache_lock(self.cache, f'{self.cache_key}.lock'):
+            yield
+
+    def acquire(self) -> float:
+        """Attend qu'un appel à l'API soit autorisé. Retourne le temps d'attente, en secondes."""
+        waited = 0.0
+
+        while True:
+            with self._lock():
+                now = time()
+
+                tokens, updated_at, blocked_until = self.cache.get(self.cache_key) or (self.capacity, now, 0.0)
+                tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                self.cache.set(self.cache_key, (tokens, now, blocked_until), timeout=60)
+
+            if not wait:
+                break
+
+            sleep(wait)
+
+            waited += wait
+
+        with self._local_lock:
+            self.calls += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+            if waited:
+                self.waited_calls += 1
+
+        return waited
+
+    def block(self, seconds: float) -> None:
+        """Suspend tous les appels pendant la durée donnée (en-tête Retry-After d'une réponse 429)."""
+        with self._lock():
+            now = time()
+
+            _, _, blocked_until = self.cache.get(self.cache_key) or (self.capacity, now, 0.0)
+
+            self.cache.set(self.cache_key, (0.0, now, max(blocked_until, now + seconds)), timeout=60)
+
+    @property
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Statistiques d'attente des appels effectués par ce processus."""
+        return {
+            'calls': self.calls,
+            'waited_calls': self.waited_calls,
+            'total_wait': self.total_wait,
+            'average_wait': self.total_wait / self.calls if self.calls else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
 class IgdbApiClient:
     client_id: str
     client_secret: str
+    rate_limiter: RateLimiter
+    response_cache_ttls: Optional[Dict[str, int]]
 
-    def __init__(self, client_id: str, client_secret: str, cache: Cache) -> None:
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        cache: Cache,
+        rate_limiter: Optional[RateLimiter] = None,
+        response_cache_ttls: Optional[Dict[str, int]] = None
+    ) -> None:
+        """Les réponses de l'API ne sont mises en cache que si `response_cache_ttls` est fourni (par exemple
+        RESPONSE_CACHE_TTLS), qui associe une durée de conservation à chaque ressource."""
         self.client_id = client_id
         self.client_secret = client_secret
         self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter(cache, client_id)
+        self.response_cache_ttls = response_cache_ttls
 
     def get_token(self) -> str:
         cache_key = f'igdb_api_client.token.{self.client_id}'
@@ -113,7 +244,7 @@ class IgdbApiClient:
             'grant_type': 'client_credentials'
         }
 
-        response = requests.post(OAUTH2_TOKEN_ENDPOINT, headers=headers, json=json)
+        response = requests.post(OAUTH2_TOKEN_ENDPOINT, headers=headers, json=json, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
 
         try:
             response.raise_for_status()
@@ -133,8 +264,6 @@ class IgdbApiClient:
 
         return json['access_token']
 
-    @sleep_and_retry
-    @limits(calls=4, period=1)
     def call(
         self,
         resource: str,
@@ -146,14 +275,57 @@ class IgdbApiClient:
         sort: Optional[str] = None,
         search: Optional[str] = None
     ) -> Dict:
-        url = API_BASE_URL + resource
-
-        headers = {
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
-            'Authorization': f'Bearer {self.get_token()}',
+        return self._post(
+            resource,
+            self.build_query(fields, exclude, where, limit, offset, sort, search)
+        )
+
+    def count(self, resource: str, where: Optional[str] = None) -> int:
+        return self._post(
+            f'{resource}/count',
+            self.build_query(where=where)
+        )['count']
+
+    def multiquery(self, queries: List[Dict]) -> Dict[str, List[Dict]]:
+        """Envoie jusqu'à MULTIQUERY_MAX_QUERIES requêtes en un seul appel à l'API.
+
+        Chaque requête est un dictionnaire contenant `resource` et `name` (unique), ainsi que les paramètres acceptés par
+        call(). Retourne les résultats indexés par nom de requête."""
+        return self.parse_multiquery(
+            self._post('multiquery', self.build_multiquery(queries))
+        )
+
+    @classmethod
+    def build_multiquery(cls, queries: List[Dict]) -> str:
+        if len(queries) > MULTIQUERY_MAX_QUERIES:
+            raise ValueError(f'{MULTIQUERY_MAX_QUERIES} requêtes maximum par multiquery')
+
+        return '\n'.join([
+            'query {resource} "{name}" {{ {query} }};'.format(
+                resource=query['resource'],
+                name=query['name'],
+                query=cls.build_query(**{
+                    k: v for k, v in query.items() if k not in ('resource', 'name')
+                }) or '',
+            ) for query in queries
+        ])
+
+    @staticmethod
+    def parse_multiquery(results: List[Dict]) -> Dict[str, List[Dict]]:
+        return {
+            result['name']: result.get('result', []) for result in results
         }
 
+    @staticmethod
+    def build_query(
+        fields: Optional[str] = None,
+        exclude: Optional[str] = None,
+        where: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        sort: Optional[str] = None,
+        search: Optional[str] = None
+    ) -> Optional[str]:
         query = {}
 
         if fields:
@@ -177,32 +349,260 @@ class IgdbApiClient:
         if search:
             query['search'] = search
 
-        data = ' '.join([
+        return ' '.join([
             f'{name} {value};' for name, value in query.items()
         ]) if query else None
 
-        response = requests.post(url, headers=headers, data=data)
+    def _post(self, endpoint: str, data: Optional[str] = None) -> Union[Dict, List]:
+        response_cache_key = self.response_cache_key(endpoint, data)
+
+        if response_cache_key:
+            result = self.cache.get(response_cache_key)
+
+            if result is not None:
+                return result
+
+        url = API_BASE_URL + endpoint
+
+        headers = {
+            'Accept': 'application/json',
+            'Client-ID': self.client_id,
+            'Authorization': f'Bearer {self.get_token()}',
+        }
+
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire()
+
+            response = requests.post(url, headers=headers, data=data, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                break
+
+            try:
+                retry_after = float(response.headers.get('Retry-After', RATE_LIMIT_PERIOD))
+            except ValueError:
+                retry_after = RATE_LIMIT_PERIOD
+
+            self.rate_limiter.block(retry_after)
 
         try:
             response.raise_for_status()
         except HTTPError as e:
             if 'application/json' in e.response.headers.get('Content-Type', ''):
-                error = e.response.json()
+                raise self.error_response(e.response.json(), response.url, response.request.body) from e
+            else:
+                raise
 
-                if isinstance(error, list):
-                    error = error[0]
+        result = response.json()
 
-                    code = error['status']
-                    message = error['title']
-                else:
-                    code = 0
-                    message = error['message']
+        self.cache_response(response_cache_key, endpoint, result, len(response.content))
 
-                raise IgdbApiErrorResponse(code, message, response.url, response.request.body) from e
+        return result
+
+    def response_cache_key(self, endpoint: str, data: Optional[str] = None) -> Optional[str]:
+        """Clé de cache d'une réponse, calculée à partir de la ressource et de la requête (qui contient tous ses
+        paramètres). None si le cache des réponses est désactivé."""
+        if self.response_cache_ttls is None:
+            return None
+
+        fingerprint = hashlib.sha1(f'{endpoint}\n{data or ""}'.encode()).hexdigest()
+
+        return f'igdb_api_client.response.{fingerprint}'
+
+    def cache_response(self, cache_key: Optional[str], endpoint: str, result: Union[Dict, List], size: int) -> None:
+        if not cache_key or size > RESPONSE_CACHE_MAX_SIZE:
+            return
+
+        self.cache.set(cache_key, result, self.response_cache_ttls.get(endpoint, RESPONSE_CACHE_DEFAULT_TTL))
+
+    @staticmethod
+    def error_response(error: Union[Dict, List], url: str, body: Optional[str] = None) -> IgdbApiErrorResponse:
+        if isinstance(error, list):
+            error = error[0]
+
+            code = error['status']
+            message = error['title']
+        else:
+            code = 0
+            message = error['message']
+
+        return IgdbApiErrorResponse(code, message, url, body)
+
+
+class AsyncIgdbApiClient(IgdbApiClient):
+    """Variante asynchrone (asyncio) d'IgdbApiClient : call(), count() et multiquery() sont des coroutines acceptant les
+    mêmes paramètres.
+
+    Les connexions HTTP sont maintenues ouvertes et limitées en nombre (les requêtes en excès attendent qu'une connexion se
+    libère), les requêtes en échec (erreur réseau, 429 ou 5xx) sont retentées avec un délai exponentiel aléatoire et, si
+    ijson est installé, les réponses sont décodées au fil de leur réception. Doit être fermé après usage (aclose() ou
+    `async with`)."""
+    http: httpx.AsyncClient
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        cache: Cache,
+        rate_limiter: Optional[RateLimiter] = None,
+        response_cache_ttls: Optional[Dict[str, int]] = None,
+        max_connections: int = RATE_LIMIT_CALLS,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT
+    ) -> None:
+        super().__init__(client_id, client_secret, cache, rate_limiter, response_cache_ttls)
+
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30.0,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+        )
+
+    async def __aenter__(self) -> 'AsyncIgdbApiClient':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+    async def get_token(self) -> str:
+        cache_key = f'igdb_api_client.token.{self.client_id}'
+
+        token = self.cache.get(cache_key)
+
+        if token:
+            return token
+
+        response = await self.http.post(
+            OAUTH2_TOKEN_ENDPOINT,
+            headers={
+                'Accept': 'application/json'
+            },
+            json={
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'client_credentials'
+            }
+        )
+
+        if response.is_error:
+            if 'application/json' in response.headers.get('Content-Type', ''):
+                error = response.json()
+
+                raise IgdbApiErrorResponse(error['status'], error['message'], str(response.url))
             else:
-                raise
+                response.raise_for_status()
+
+        json = response.json()
+
+        self.cache.set(cache_key, json['access_token'], json['expires_in'] - 5)
+
+        return json['access_token']
+
+    async def call(
+        self,
+        resource: str,
+        fields: Optional[str] = None,
+        exclude: Optional[str] = None,
+        where: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        sort: Optional[str] = None,
+        search: Optional[str] = None
+    ) -> Dict:
+        return await self._post(
+            resource,
+            self.build_query(fields, exclude, where, limit, offset, sort, search)
+        )
+
+    async def count(self, resource: str, where: Optional[str] = None) -> int:
+        return (await self._post(
+            f'{resource}/count',
+            self.build_query(where=where)
+        ))['count']
+
+    async def multiquery(self, queries: List[Dict]) -> Dict[str, List[Dict]]:
+        return self.parse_multiquery(
+            await self._post('multiquery', self.build_multiquery(queries))
+        )
+
+    async def _post(self, endpoint: str, data: Optional[str] = None) -> Union[Dict, List]:
+        response_cache_key = self.response_cache_key(endpoint, data)
+
+        if response_cache_key:
+            result = self.cache.get(response_cache_key)
+
+            if result is not None:
+                return result
+
+        url = API_BASE_URL + endpoint
+
+        headers = {
+            'Accept': 'application/json',
+            'Client-ID': self.client_id,
+            'Authorization': f'Bearer {await self.get_token()}',
+        }
+
+        for attempt in range(MAX_RETRIES + 1):
+            # Le limiteur de débit est synchrone (attente et accès au cache) : il est exécuté dans un thread à part
+            await asyncio.to_thread(self.rate_limiter.acquire)
+
+            try:
+                async with self.http.stream('POST', url, headers=headers, content=data) as response:
+                    if (response.status_code != 429 and response.status_code < 500) or attempt == MAX_RETRIES:
+                        if response.is_error:
+                            await response.aread()
+
+                            if 'application/json' in response.headers.get('Content-Type', ''):
+                                raise self.error_response(response.json(), str(response.url), data)
+                            else:
+                                response.raise_for_status()
+
+                        result = await self._decode(response)
+
+                        self.cache_response(response_cache_key, endpoint, result, response.num_bytes_downloaded)
+
+                        return result
+
+                    retry_after = response.headers.get('Retry-After')
+            except httpx.TransportError:
+                if attempt == MAX_RETRIES:
+                    raise
+
+                retry_after = None
+
+            # Délai exponentiel avec "full jitter" afin d'éviter que les requêtes en échec ne soient retentées en même temps
+            delay = random.uniform(0, RATE_LIMIT_PERIOD * 2 ** attempt)
+
+            if retry_after:
+                try:
+                    await asyncio.to_thread(self.rate_limiter.block, float(retry_after))
+                except ValueError:
+                    pass
+
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _decode(response: httpx.Response) -> Any:
+        if not ijson:
+            await response.aread()
+
+            return response.json()
+
+        result = ijson.sendable_list()
+        coroutine = ijson.items_coro(result, '', use_float=True)
+
+        async for chunk in response.aiter_bytes():
+            coroutine.send(chunk)
+
+        coroutine.close()
 
-        return response.json()
+        return result[0]
 
 
-__all__ = ['IgdbApiErrorResponse', 'IgdbApiClient', 'GameMode', 'GameStatus', 'GameType', 'Website']
+__all__ = ['IgdbApiErrorResponse', 'RateLimiter', 'IgdbApiClient', 'AsyncIgdbApiClient', 'GameMode', 'GameStatus', 'GameType', 'Website']
@@ -0,0 +1,65 @@
+from flask_caching.backends.filesystemcache import FileSystemCache
+from contextlib import contextmanager
+from flask_caching import Cache
+from typing import Iterator
+from time import sleep
+import hashlib
+import secrets
+import os
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+@contextmanager
+def cache_lock(cache: Cache, key: str, timeout: int = 1) -> Iterator[None]:
+    """Verrou partagé entre les processus utilisant le même cache.
+
+    Avec le backend FileSystemCache, il s'agit d'un verrou flock() posé sur un fichier du répertoire du cache : il est
+    libéré par le système si son détenteur est interrompu. Avec les autres backends, il est posé via add(), qui n'est
+    atomique entre processus qu'avec ceux qui le garantissent (Redis, Memcached...) : c'est l'un d'eux qu'il faut utiliser
+    pour partager une limitation entre plusieurs serveurs. Le verrou expire alors de lui-même au bout de `timeout` secondes
+    au cas où son détenteur aurait été interrompu, et n'est libéré que s'il lui appartient toujours."""
+    if fcntl and isinstance(cache.cache, FileSystemCache):
+        with _file_lock(cache.cache, key):
+            yield
+
+        return
+
+    token = secrets.token_hex(8)
+
+    while not cache.add(key, token, timeout=timeout):
+        # Un verrou expiré qui n'aurait pas été supprimé par le backend est récupéré
+        if cache.get(key) is None:
+            cache.delete(key)
+        else:
+            sleep(0.005)
+
+    try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+@contextmanager
+def _file_lock(backend: FileSystemCache, key: str) -> Iterator[None]:
+    # FileSystemCache.add() ne tient pas compte de l'expiration des entrées et n'est pas atomique : un verrou flock() est
+    # utilisé à la place, un descripteur de fichier distinct étant ouvert à chaque fois afin d'exclure aussi les threads.
+    # Les fichiers de verrous sont placés à côté du répertoire du cache, que le backend purge et vide librement
+    directory = f'{backend._path.rstrip(os.sep)}-locks'
+
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, f'{hashlib.sha1(key.encode()).hexdigest()}.lock')
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        yield
+    finally:
+        os.close(fd)
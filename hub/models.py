@@ -1,16 +1,27 @@
 from __future__ import annotations
-from sqlalchemy.orm import mapped_column, relationship
-from typing import Optional, Union, List, Dict, Any
+from sqlalchemy.orm import mapped_column, relationship, undefer_group
+from typing import Optional, Union, List, Dict, Set, Tuple, Type, TypeVar, Any
 from sqlalchemy_utils.types import TSVectorType
-from sqlalchemy.util import memoized_property
 from sqlalchemy.dialects import postgresql
 from urllib.parse import quote_plus
-from datetime import UTC, datetime
+from datetime import UTC, datetime, timedelta
 from flask_login import UserMixin
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
 from enum import StrEnum
-from app import db
+import unicodedata
+import hashlib
+import secrets
+import heapq
+import re
+from app import app, db, cache
 import sqlalchemy as sa
 
+E = TypeVar('E', bound=StrEnum)
+
+DISCORD_EPOCH = 1420070400000 # Millisecondes, origine des dates encodées dans les snowflakes Discord
+
 
 class CreatedAtMixin:
     created_at = mapped_column(sa.DateTime, nullable=False, default=lambda: datetime.now(UTC))
@@ -23,35 +34,182 @@ class UpdatedAtMixin:
 class VotableMixin:
     user_id = mapped_column(sa.BigInteger, sa.ForeignKey('users.id', ondelete='cascade'), nullable=False)
 
-    def votes_by_type(self, type_: VoteType) -> List[Union[LanGameProposalVote, LanAccommodationProposalVote]]:
-        return [
-            vote for vote in self.votes if vote.type == type_
-        ]
+    # Compteurs dénormalisés, maintenus à jour par des triggers PostgreSQL sur la table des votes correspondante
+    yes_count = mapped_column(sa.Integer, nullable=False, default=0, server_default=sa.text('0'))
+    neutral_count = mapped_column(sa.Integer, nullable=False, default=0, server_default=sa.text('0'))
+    no_count = mapped_column(sa.Integer, nullable=False, default=0, server_default=sa.text('0'))
+    score = mapped_column(sa.Integer, nullable=False, default=0, server_default=sa.text('0'), index=True)
+    votes_version = mapped_column(sa.Integer, nullable=False, default=0, server_default=sa.text('0'))
 
     def votes_count(self, type_: VoteType) -> int:
-        return len(self.votes_by_type(type_))
+        return getattr(self, f'{type_.value.lower()}_count') or 0
+
+    @property
+    def votes_total(self) -> int:
+        return sum([
+            self.votes_count(vote_type) for vote_type in VoteType
+        ])
 
     def votes_percentage(self, type_: VoteType) -> float:
-        votes_total = len(self.votes)
+        votes_total = self.votes_total
 
         if votes_total == 0:
             return 0.0
 
         return self.votes_count(type_) / votes_total
 
-    @memoized_property
+    @classmethod
+    def tally_query(
+        cls,
+        user: Optional[User] = None,
+        voters: Optional[sa.ColumnElement[bool]] = None,
+        filter_: Optional[VoteFilter] = None,
+        with_voters: bool = False
+    ) -> sa.Select:
+        """Construit une requête retournant chaque proposition accompagnée du décompte de ses votes (voir VoteTally).
+
+        `voters` est la condition désignant les utilisateurs appelés à voter (leur nombre est alors calculé par une sous-requête
+        scalaire), `filter_` restreint les propositions retournées directement dans la requête et `with_voters` ajoute le nom
+        des votants pour chaque type de vote."""
+        vote_cls = cls.votes.property.mapper.class_
+        votes_join = cls.votes.property.primaryjoin
+
+        columns = []
+
+        if with_voters:
+            for vote_type in VoteType:
+                columns.append(
+                    sa.select(sa.func.array_agg(postgresql.aggregate_order_by(User.display_name, User.display_name)))
+                    .join(vote_cls, vote_cls.user_id == User.id)
+                    .where(votes_join, vote_cls.type == vote_type)
+                    .scalar_subquery()
+                    .label(VoteTally.voters_label(vote_type))
+                )
+
+        if user:
+            columns.append(
+                sa.select(vote_cls.type)
+                .where(votes_join, vote_cls.user_id == user.id)
+                .scalar_subquery()
+                .label('my_vote')
+            )
+
+        voters_count = None
+
+        if voters is not None:
+            voters_count = sa.select(sa.func.count()).select_from(User).where(voters).scalar_subquery()
+
+            columns.append(
+                voters_count.label('voters_count')
+            )
+
+        query = sa.select(cls, *columns).order_by(cls.score.desc())
+
+        if filter_ in (VoteFilter.VOTED, VoteFilter.NOT_VOTED):
+            if not user:
+                raise ValueError(f'Le filtre {filter_} nécessite un utilisateur')
+
+            voted = cls.votes.any(vote_cls.user_id == user.id)
+
+            query = query.where(voted if filter_ == VoteFilter.VOTED else ~voted)
+        elif filter_ in (VoteFilter.ALL_VOTED, VoteFilter.NOT_ALL_VOTED):
+            if voters_count is None:
+                raise ValueError(f'Le filtre {filter_} nécessite des votants')
+
+            votes_count = cls.yes_count + cls.neutral_count + cls.no_count
+
+            query = query.where(votes_count == voters_count if filter_ == VoteFilter.ALL_VOTED else votes_count != voters_count)
+
+        return query
+
+    @classmethod
+    def state_fingerprint(cls) -> Tuple:
+        """Calcule, en une seule requête, une empreinte de l'état des propositions, de leurs votes et des utilisateurs."""
+        pk = cls.__mapper__.primary_key[0]
+
+        return tuple(
+            db.session.execute(
+                sa.select(
+                    sa.func.count(),
+                    sa.func.sum(pk),
+                    sa.func.sum(cls.votes_version),
+                    sa.func.max(getattr(cls, 'updated_at', cls.created_at)),
+                    sa.select(sa.func.count()).select_from(User).scalar_subquery(),
+                    sa.select(sa.func.max(User.updated_at)).scalar_subquery(),
+                ).select_from(cls)
+            ).one()
+        )
+
+    @classmethod
+    def tally(cls, query: sa.Select) -> List[VoteTally]:
+        return [
+            VoteTally(row) for row in db.session.execute(query).all()
+        ]
+
+
+class VoteTally:
+    """Résultat allégé du décompte des votes d'une proposition, tel que calculé par VotableMixin.tally_query()."""
+    __slots__ = ('proposal', 'voters', 'my_vote', 'voters_count')
+
+    proposal: Union[LanGameProposal, LanAccommodationProposal]
+    voters: Dict[VoteType, List[str]]
+    my_vote: Optional[VoteType]
+    voters_count: Optional[int]
+
+    def __init__(self, row: sa.Row) -> None:
+        mapping = row._mapping
+
+        self.proposal = row[0]
+        self.voters = {
+            vote_type: mapping.get(self.voters_label(vote_type)) or [] for vote_type in VoteType
+        }
+        self.my_vote = mapping.get('my_vote')
+        self.voters_count = mapping.get('voters_count')
+
+    @staticmethod
+    def voters_label(vote_type: VoteType) -> str:
+        return f'{vote_type.value.lower()}_voters'
+
+    @property
     def score(self) -> int:
-        score = 0
+        return self.proposal.score
+
+    @property
+    def votes_total(self) -> int:
+        return self.proposal.votes_total
+
+    @property
+    def is_essential(self) -> bool:
+        return self.voters_count is not None and self.votes_count(VoteType.YES) == self.voters_count
 
-        for vote in self.votes:
-            if vote.type == VoteType.YES:
-                score += 2
-            elif vote.type == VoteType.NEUTRAL:
-                score += 1
-            elif vote.type == VoteType.NO:
-                score -= 1
+    @property
+    def cache_key(self) -> str:
+        """Identifie l'état des votes de la proposition tel que vu par l'utilisateur courant.
+
+        La date de création distingue une proposition supprimée puis proposée à nouveau (dont `votes_version` repart de
+        zéro), et l'empreinte des noms des votants prend en compte leurs changements de nom."""
+        return '{}.{}.{}.{}.{}'.format(
+            int(self.proposal.created_at.timestamp() * 1000000),
+            self.proposal.votes_version,
+            self.my_vote or '',
+            int(self.is_essential),
+            hashlib.sha1(repr(sorted(self.voters.items())).encode()).hexdigest()[:12]
+        )
+
+    def votes_count(self, type_: VoteType) -> int:
+        return self.proposal.votes_count(type_)
 
-        return score
+    def votes_percentage(self, type_: VoteType) -> float:
+        return self.proposal.votes_percentage(type_)
+
+    def __repr__(self) -> str:
+        return f'VoteTally:{self.proposal!r}'
+
+
+class SectionStatus(StrEnum):
+    DISABLED = 'disabled'
+    ENABLED = 'enabled'
+    READ_ONLY = 'read_only'
 
 
 # ATTENTION : Ne jamais modifier cette liste. Il est possible d'ajouter des éléments, à la fin de la liste uniquement.
@@ -67,6 +225,13 @@ class VoteType(StrEnum):
         ])
 
 
+class VoteFilter(StrEnum):
+    VOTED = 'voted'
+    NOT_VOTED = 'not-voted'
+    ALL_VOTED = 'all-voted'
+    NOT_ALL_VOTED = 'not-all-voted'
+
+
 # ATTENTION : Ne jamais modifier cette liste. Il est possible d'ajouter des éléments, à la fin de la liste uniquement.
 class UserKitchenPreference(StrEnum):
     COOK = 'cook'
@@ -218,23 +383,24 @@ class User(CreatedAtMixin, UpdatedAtMixin, UserMixin, db.Model):
     is_admin = mapped_column(sa.Boolean, nullable=False, default=False, server_default=sa.text('false'))
     must_relogin = mapped_column(sa.Boolean, nullable=False, default=False, server_default=sa.text('false'))
 
-    allergies = mapped_column(sa.String(255))
-    special_diet = mapped_column(sa.String(255))
-    is_vegetarian = mapped_column(sa.Boolean)
-    kitchen = mapped_column(sa.Enum(UserKitchenPreference))
-    water = mapped_column(sa.Enum(UserWaterPreference))
-    hot_drinks = mapped_column(sa.Enum(UserHotDrinksPreference))
-    breakfast = mapped_column(sa.Enum(UserBreakfastPreference))
-    breads = mapped_column(sa.Enum(UserBreadsPreference))
-    cheeses = mapped_column(sa.String(255))
-    spicy_dishes = mapped_column(sa.Boolean)
-    alcohol = mapped_column(sa.Enum(UserAlcoholPreference))
-    meat = mapped_column(sa.String(255))
-    chicken = mapped_column(sa.Enum(UserChickenPreference))
-    dry_sausage = mapped_column(sa.Enum(UserDrySausagePreference))
-    thai_cuisine = mapped_column(sa.Boolean)
-    pate = mapped_column(sa.Enum(UserPatePreference))
-    other_preferences = mapped_column(sa.String(255))
+    # Préférences, chargées uniquement à la demande et en une seule requête
+    allergies = mapped_column(sa.String(255), deferred=True, deferred_group='preferences')
+    special_diet = mapped_column(sa.String(255), deferred=True, deferred_group='preferences')
+    is_vegetarian = mapped_column(sa.Boolean, deferred=True, deferred_group='preferences')
+    kitchen = mapped_column(sa.Enum(UserKitchenPreference), deferred=True, deferred_group='preferences')
+    water = mapped_column(sa.Enum(UserWaterPreference), deferred=True, deferred_group='preferences')
+    hot_drinks = mapped_column(sa.Enum(UserHotDrinksPreference), deferred=True, deferred_group='preferences')
+    breakfast = mapped_column(sa.Enum(UserBreakfastPreference), deferred=True, deferred_group='preferences')
+    breads = mapped_column(sa.Enum(UserBreadsPreference), deferred=True, deferred_group='preferences')
+    cheeses = mapped_column(sa.String(255), deferred=True, deferred_group='preferences')
+    spicy_dishes = mapped_column(sa.Boolean, deferred=True, deferred_group='preferences')
+    alcohol = mapped_column(sa.Enum(UserAlcoholPreference), deferred=True, deferred_group='preferences')
+    meat = mapped_column(sa.String(255), deferred=True, deferred_group='preferences')
+    chicken = mapped_column(sa.Enum(UserChickenPreference), deferred=True, deferred_group='preferences')
+    dry_sausage = mapped_column(sa.Enum(UserDrySausagePreference), deferred=True, deferred_group='preferences')
+    thai_cuisine = mapped_column(sa.Boolean, deferred=True, deferred_group='preferences')
+    pate = mapped_column(sa.Enum(UserPatePreference), deferred=True, deferred_group='preferences')
+    other_preferences = mapped_column(sa.String(255), deferred=True, deferred_group='preferences')
 
     game_proposals = relationship('LanGameProposal', back_populates='user')
     accommodation_proposals = relationship('LanAccommodationProposal', back_populates='user')
@@ -242,15 +408,97 @@ class User(CreatedAtMixin, UpdatedAtMixin, UserMixin, db.Model):
     game_votes = relationship('LanGameProposalVote', back_populates='user')
     accommodation_votes = relationship('LanAccommodationProposalVote', back_populates='user')
 
-    def my_vote(self, proposal: Union[LanGameProposal, LanAccommodationProposal]) -> Optional[Union[LanGameProposal, LanAccommodationProposal]]:
-        return next((vote for vote in proposal.votes if vote.user_id == self.id), None)
-
     def __repr__(self) -> str:
         return f'User:{self.id}'
 
 
+class UserSession:
+    """Instantané compact d'un utilisateur (identité et rôles), tel que mis en cache pour Flask-Login.
+
+    L'entité User complète n'est chargée depuis la BDD que lorsqu'un attribut absent de l'instantané (par exemple une
+    préférence) est lu, ou via la propriété `model`."""
+    FIELDS = ('id', 'display_name', 'avatar_url', 'is_member', 'is_lan_participant', 'is_lan_organizer', 'is_admin', 'must_relogin')
+
+    __slots__ = FIELDS + ('_model',)
+
+    id: int
+    display_name: str
+    avatar_url: Optional[str]
+    is_member: bool
+    is_lan_participant: bool
+    is_lan_organizer: bool
+    is_admin: bool
+    must_relogin: bool
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, values: Tuple, model: Optional[User] = None) -> None:
+        for field, value in zip(self.FIELDS, values):
+            setattr(self, field, value)
+
+        self._model = model
+
+    @classmethod
+    def cache_key(cls, user_id: Union[int, str]) -> str:
+        return f'user_session.{user_id}'
+
+    @classmethod
+    def load(cls, user_id: Union[int, str]) -> Optional[UserSession]:
+        cache_key = cls.cache_key(user_id)
+
+        values = cache.get(cache_key)
+
+        if values:
+            return cls(values)
+
+        user = db.session.get(User, user_id)
+
+        if not user:
+            return None
+
+        values = tuple(
+            getattr(user, field) for field in cls.FIELDS
+        )
+
+        cache.set(cache_key, values, app.config['USER_SESSION_CACHE_TIMEOUT'])
+
+        return cls(values, user)
+
+    @classmethod
+    def forget(cls, *user_ids: Union[int, str]) -> None:
+        if user_ids:
+            cache.delete_many(*[
+                cls.cache_key(user_id) for user_id in user_ids
+            ])
+
+    @property
+    def model(self) -> User:
+        if self._model is None:
+            self._model = db.session.get(User, self.id, options=[undefer_group('preferences')])
+
+        return self._model
+
+    def get_id(self) -> str:
+        return str(self.id)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self.model, name)
+
+    def __repr__(self) -> str:
+        return f'UserSession:{self.id}'
+
+
 class Game(db.Model):
     __tablename__ = 'games'
+    __table_args__ = (
+        # Index trigrammes (pg_trgm) utilisé par l'autocomplétion : recherche par sous-chaîne et recherche approximative
+        sa.Index('ix_games_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = mapped_column(sa.BigInteger, primary_key=True, autoincrement=False)
 
@@ -259,6 +507,7 @@ class Game(db.Model):
     url = mapped_column(sa.String(255))
     image_id = mapped_column(sa.String(25))
     single_owner_enough = mapped_column(sa.Boolean, nullable=False, default=False, server_default=sa.text('false'))
+    popularity = mapped_column(sa.Integer, nullable=False, default=0, server_default=sa.text('0')) # Nombre de notes sur IGDB
 
     proposal = relationship('LanGameProposal', uselist=False, back_populates='game')
 
@@ -276,10 +525,52 @@ class Game(db.Model):
 
         return f'https://images.igdb.com/igdb/image/upload/t_cover_small/{self.image_id}.png'
 
+    @property
+    def cache_key(self) -> str:
+        """Empreinte des informations affichées du jeu, mises à jour lors de la synchronisation avec IGDB."""
+        return hashlib.sha1(
+            repr((self.name, self.url, self.image_id, self.single_owner_enough)).encode()
+        ).hexdigest()[:12]
+
+    @classmethod
+    def autocomplete_query(cls, terms: str, limit: int = 25) -> sa.Select:
+        """Requête de recherche de jeux pour l'autocomplétion, s'appuyant sur l'index trigrammes : contrairement à la
+        recherche plein texte, elle trouve les mots partiels ("sati" pour "Satisfactory") et tolère les fautes de frappe.
+
+        Les jeux dont le nom commence par les termes recherchés sont classés en premier, puis par similarité."""
+        terms = terms.strip()
+
+        return sa.select(cls.id, cls.name).where(
+            sa.or_(
+                cls.name.icontains(terms, autoescape=True),
+                sa.literal(terms).op('<%')(cls.name), # Similarité de mot (word_similarity) suffisante
+            )
+        ).order_by(
+            cls.name.istartswith(terms, autoescape=True).desc(),
+            sa.func.word_similarity(terms, cls.name).desc(),
+            sa.func.length(cls.name).asc(),
+        ).limit(limit)
+
     def __repr__(self) -> str:
         return f'Game:{self.id}'
 
 
+# Table intermédiaire dans laquelle la commande update_games charge les jeux reçus d'IGDB avant de les fusionner dans la
+# table games. Non journalisée (son contenu peut être perdu en cas de crash de PostgreSQL) mais persistante, ce qui permet
+# de reprendre un import interrompu
+games_staging = sa.Table(
+    'games_staging',
+    db.metadata,
+    sa.Column('id', sa.BigInteger, nullable=False, index=True),
+    sa.Column('name', sa.String(255), nullable=False),
+    sa.Column('url', sa.String(255)),
+    sa.Column('image_id', sa.String(25)),
+    sa.Column('single_owner_enough', sa.Boolean, nullable=False),
+    sa.Column('popularity', sa.Integer, nullable=False, server_default=sa.text('0')),
+    prefixes=['UNLOGGED'],
+)
+
+
 class LanGameProposal(VotableMixin, CreatedAtMixin, db.Model):
     __tablename__ = 'lan_game_proposals'
 
@@ -290,7 +581,41 @@ class LanGameProposal(VotableMixin, CreatedAtMixin, db.Model):
     game = relationship('Game', uselist=False, back_populates='proposal')
     user = relationship('User', uselist=False, back_populates='game_proposals')
 
-    is_essential: bool = False
+    @classmethod
+    def game_ids(cls) -> Set[int]:
+        """IDs des jeux déjà proposés, mis en cache jusqu'à l'ajout ou la suppression d'une proposition."""
+        game_ids = cache.get('lan_game_proposals.game_ids')
+
+        if game_ids is None:
+            game_ids = set(db.session.execute(sa.select(cls.game_id)).scalars().all())
+
+            cache.set('lan_game_proposals.game_ids', game_ids, timeout=app.config['LAN_GAME_PROPOSALS_CACHE_TIMEOUT'])
+
+        return game_ids
+
+    @classmethod
+    def forget_game_ids(cls) -> None:
+        cache.delete('lan_game_proposals.game_ids')
+
+    @classmethod
+    def top_version(cls) -> str:
+        """Version du classement des propositions, sur laquelle sont indexés les rendus mis en cache de celui-ci. Elle est
+        renouvelée (voir forget_top()) après chaque modification des propositions, de leurs votes ou des participants."""
+        version = cache.get('lan_game_proposals.top_version')
+
+        if version is None:
+            version = secrets.token_hex(8)
+
+            if not cache.add('lan_game_proposals.top_version', version, timeout=0):
+                version = cache.get('lan_game_proposals.top_version') or version
+
+        return version
+
+    @classmethod
+    def forget_top(cls) -> None:
+        """Invalide les rendus du classement mis en cache. Doit être appelée une fois la modification validée en BDD, afin
+        qu'un rendu concurrent ne puisse pas enregistrer l'ancien classement sous la nouvelle version."""
+        cache.set('lan_game_proposals.top_version', secrets.token_hex(8), timeout=0)
 
     def __repr__(self) -> str:
         return f'LanGameProposal:{self.game_id}'
@@ -393,11 +718,256 @@ class LanAccommodationProposalVote(CreatedAtMixin, UpdatedAtMixin, db.Model):
         return f'LanAccommodationProposalVote:{self.accommodation_proposal_id}+{self.user_id}'
 
 
+class DiscordOutboxMessageType(StrEnum):
+    GAME_PROPOSAL = 'GAME_PROPOSAL'
+    GAME_PROPOSAL_VOTES = 'GAME_PROPOSAL_VOTES'
+    GAME_PROPOSAL_THREAD = 'GAME_PROPOSAL_THREAD'
+    ACCOMMODATION_PROPOSAL = 'ACCOMMODATION_PROPOSAL'
+    ACCOMMODATION_PROPOSAL_THREAD = 'ACCOMMODATION_PROPOSAL_THREAD'
+    INTERACTION_RESPONSE = 'INTERACTION_RESPONSE'
+
+
+class DiscordOutboxMessage(CreatedAtMixin, db.Model):
+    """Message Discord à envoyer (ou à mettre à jour), enregistré dans la même transaction que la modification qui en est
+    à l'origine puis envoyé par la commande discord_outbox_worker.
+
+    Les messages en échec définitif (voir fail()) sont conservés avec leur dernière erreur, mais ne sont plus envoyés."""
+    __tablename__ = 'discord_outbox_messages'
+
+    id = mapped_column(sa.BigInteger, primary_key=True)
+    type = mapped_column(sa.Enum(DiscordOutboxMessageType), nullable=False)
+    object_id = mapped_column(sa.BigInteger, nullable=False)
+    payload = mapped_column(postgresql.JSONB)
+    attempts = mapped_column(sa.Integer, nullable=False, default=0, server_default=sa.text('0'))
+    last_error = mapped_column(sa.Text)
+    available_at = mapped_column(sa.DateTime, nullable=False, default=lambda: datetime.now(UTC), index=True)
+    leased_until = mapped_column(sa.DateTime)
+    requeue_at = mapped_column(sa.DateTime)
+    failed_at = mapped_column(sa.DateTime)
+
+    __table_args__ = (
+        # Un seul message actif (en attente, en cours d'envoi ou en échec temporaire) par objet
+        sa.Index(
+            'ix_discord_outbox_messages_active',
+            'type',
+            'object_id',
+            unique=True,
+            postgresql_where=sa.text('failed_at IS NULL')
+        ),
+    )
+
+    @classmethod
+    def enqueue(cls, type_: DiscordOutboxMessageType, object_id: int, delay: int = 0, payload: Optional[Dict] = None) -> None:
+        """Ajoute un message dans la transaction courante : il ne sera envoyé qu'une fois celle-ci validée, et au plus tôt
+        dans `delay` secondes. `payload` contient les éventuelles données nécessaires à l'envoi.
+
+        Si un message identique est déjà actif, aucun autre n'est ajouté, ce qui regroupe en un seul envoi les demandes
+        rapprochées : le message existant est avancé si besoin ou, s'il est en cours d'envoi, sera renvoyé une fois
+        celui-ci terminé."""
+        now = datetime.now(UTC)
+        available_at = now + timedelta(seconds=delay)
+
+        query = postgresql.insert(cls).values(
+            type=type_,
+            object_id=object_id,
+            payload=payload,
+            available_at=available_at
+        )
+
+        leased = sa.and_(cls.leased_until != None, cls.leased_until > now)
+
+        db.session.execute(query.on_conflict_do_update(
+            index_elements=[
+                cls.type,
+                cls.object_id,
+            ],
+            index_where=sa.text('failed_at IS NULL'),
+            set_={
+                cls.available_at: sa.case(
+                    (leased, cls.available_at),
+                    else_=sa.func.least(cls.available_at, query.excluded.available_at)
+                ),
+                cls.requeue_at: sa.case(
+                    (leased, sa.func.least(sa.func.coalesce(cls.requeue_at, query.excluded.available_at), query.excluded.available_at)),
+                    else_=cls.requeue_at
+                ),
+            }
+        ))
+
+    @classmethod
+    def claim(cls) -> Optional[DiscordOutboxMessage]:
+        """Réserve le prochain message à envoyer.
+
+        Les messages en cours de réservation par d'autres workers sont ignorés (SKIP LOCKED). Le message réservé n'est plus
+        disponible pendant `DISCORD_OUTBOX_LEASE` secondes, ce qui permet de l'envoyer hors transaction et de le réessayer
+        si le worker s'arrête avant d'avoir terminé."""
+        now = datetime.now(UTC)
+
+        message = db.session.execute(
+            sa.select(cls)
+            .where(
+                cls.failed_at == None,
+                cls.available_at <= now,
+                sa.or_(cls.leased_until == None, cls.leased_until <= now)
+            )
+            # Les réponses aux interactions, attendues par les utilisateurs, passent en priorité
+            .order_by((cls.type == DiscordOutboxMessageType.INTERACTION_RESPONSE).desc(), cls.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+
+        if message:
+            message.attempts += 1
+            message.leased_until = now + timedelta(seconds=app.config['DISCORD_OUTBOX_LEASE'])
+
+        db.session.commit()
+
+        return message
+
+    def complete(self) -> None:
+        """Supprime le message envoyé, sauf s'il a de nouveau été demandé entre-temps : il est alors remis en attente."""
+        deleted = db.session.execute(
+            sa.delete(DiscordOutboxMessage).where(
+                DiscordOutboxMessage.id == self.id,
+                DiscordOutboxMessage.requeue_at == None
+            )
+        ).rowcount
+
+        if not deleted:
+            db.session.execute(
+                sa.update(DiscordOutboxMessage).where(DiscordOutboxMessage.id == self.id).values(
+                    available_at=DiscordOutboxMessage.requeue_at,
+                    requeue_at=None,
+                    leased_until=None,
+                    attempts=0,
+                    last_error=None
+                )
+            )
+
+        db.session.commit()
+
+    @property
+    def expires_at(self) -> Optional[datetime]:
+        """Date au-delà de laquelle le message ne peut plus être envoyé : le jeton d'une interaction Discord n'est valide
+        que pendant un temps limité après sa création, dont la date est encodée dans son ID (snowflake)."""
+        if self.type != DiscordOutboxMessageType.INTERACTION_RESPONSE:
+            return None
+
+        created_at = datetime.fromtimestamp(((self.object_id >> 22) + DISCORD_EPOCH) / 1000, UTC)
+
+        return created_at + timedelta(seconds=app.config['DISCORD_INTERACTION_TOKEN_LIFETIME'])
+
+    def fail(self, error: Exception, permanent: bool = False) -> None:
+        """Reprogramme l'envoi du message avec un délai croissant selon le nombre de tentatives (une heure au maximum).
+
+        L'échec est définitif si `permanent` est vrai (l'erreur ne se résoudra pas d'elle-même), si le nombre maximal de
+        tentatives (`DISCORD_OUTBOX_MAX_ATTEMPTS`) est atteint ou si le message aura expiré avant la tentative suivante."""
+        now = datetime.now(UTC)
+        retry_at = now + timedelta(seconds=min(10 * 2 ** (self.attempts - 1), 60 * 60))
+        expires_at = self.expires_at
+
+        self.last_error = str(error)
+        self.leased_until = None
+
+        if permanent or self.attempts >= app.config['DISCORD_OUTBOX_MAX_ATTEMPTS'] or (expires_at and retry_at >= expires_at):
+            self.failed_at = now
+        else:
+
+            # Un nouvel envoi demandé pendant cette tentative peut avancer la suivante
+            self.available_at = sa.func.least(retry_at, sa.func.coalesce(DiscordOutboxMessage.requeue_at, retry_at))
+            self.requeue_at = None
+
+        db.session.commit()
+
+    def __repr__(self) -> str:
+        return f'DiscordOutboxMessage:{self.id}'
+
+
+class SettingsCache:
+    """Cache local au processus de l'ensemble des paramètres.
+
+    La fraîcheur du cache est vérifiée au plus une fois toutes les `SETTINGS_CACHE_POLL_INTERVAL` secondes en comparant
+    un tampon de version (nombre de paramètres et date de dernière modification) à celui de la BDD. Les paramètres ne sont
+    rechargés (et donc désérialisés) que lorsque ce tampon a changé."""
+    values: Optional[Dict[str, Any]]
+    version: Optional[Tuple[int, Optional[datetime]]]
+    checked_at: float
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.values = None
+            self.version = None
+            self.checked_at = 0.0
+
+    def get(self, name: Union[str, List[str]], default: Any = None) -> Union[str, Dict[str, Any], Any]:
+        values = self._fresh_values()
+
+        if isinstance(name, str):
+            return values.get(name) or default
+        elif isinstance(name, list):
+            return {
+                n: values.get(n, default) for n in name
+            }
+
+    def load(self) -> Dict[str, Any]:
+        """Charge l'ensemble des paramètres en une seule requête (utilisé notamment au démarrage des workers)."""
+        with self.lock:
+            return self._load(self._current_version())
+
+    def _current_version(self) -> Tuple[int, Optional[datetime]]:
+        return tuple(
+            db.session.execute(
+                sa.select(sa.func.count(), sa.func.max(Setting.updated_at))
+            ).one()
+        )
+
+    def _load(self, version: Tuple[int, Optional[datetime]]) -> Dict[str, Any]:
+        self.values = {
+            n: v for n, v in db.session.execute(
+                sa.select(Setting.name, Setting.value)
+            ).all()
+        }
+
+        self.version = version
+        self.checked_at = monotonic()
+
+        return self.values
+
+    def _fresh_values(self) -> Dict[str, Any]:
+        now = monotonic()
+
+        # Lecture unique : invalidate() peut vider le cache à tout moment depuis un autre thread
+        values = self.values
+
+        if values is not None and now - self.checked_at < app.config['SETTINGS_CACHE_POLL_INTERVAL']:
+            return values
+
+        with self.lock:
+            values = self.values
+
+            if values is not None and now - self.checked_at < app.config['SETTINGS_CACHE_POLL_INTERVAL']:
+                return values
+
+            version = self._current_version()
+
+            if values is None or version != self.version:
+                return self._load(version)
+
+            self.checked_at = now
+
+            return values
+
+
 class Setting(UpdatedAtMixin, db.Model):
     __tablename__ = 'settings'
 
     name = mapped_column(sa.String(255), primary_key=True, autoincrement=False)
-    value = mapped_column(sa.PickleType)
+    value = mapped_column(postgresql.JSONB)
 
     @classmethod
     def get(cls, name: Union[str, List[str]], default: Any = None) -> Union[str, Dict[str, Any], Any]:
@@ -416,6 +986,21 @@ class Setting(UpdatedAtMixin, db.Model):
                 n: result.get(n, default) for n in name
             }
 
+    @classmethod
+    def get_enum(cls, name: str, enum: Type[E], default: E) -> E:
+        value = settings_cache.get(name)
+
+        try:
+            return enum(value) if value is not None else default
+        except ValueError:
+            return default
+
+    @classmethod
+    def get_int(cls, name: str, default: int = 0) -> int:
+        value = settings_cache.get(name)
+
+        return value if isinstance(value, int) and not isinstance(value, bool) else default
+
     @classmethod
     def set(cls, name: Union[str, Dict[str, Any]], value: Optional[Any] = None) -> None:
         query = postgresql.insert(cls)
@@ -443,6 +1028,8 @@ class Setting(UpdatedAtMixin, db.Model):
             }
         ))
 
+        settings_cache.invalidate()
+
     @classmethod
     def delete(cls, name: Union[str, List[str]]) -> None:
         query = sa.delete(cls)
@@ -454,5 +1041,127 @@ class Setting(UpdatedAtMixin, db.Model):
 
         db.session.execute(query)
 
+        settings_cache.invalidate()
+
+
+class GameNameIndex:
+    """Index en mémoire (local au processus) des noms de jeux, permettant de rechercher des jeux par préfixes de mots sans
+    interroger la BDD.
+
+    Il est construit au premier usage (ou au démarrage des workers) et reconstruit lorsque le tampon de version du
+    catalogue (paramètre `games_catalogue_version`, écrit par la commande update_games) change. Ce tampon étant lu depuis
+    le cache des paramètres, l'index n'est vérifié qu'au rythme de ce dernier."""
+    # (version du catalogue, IDs des jeux, noms des jeux, noms normalisés, popularité des jeux, mots triés, position du jeu
+    # de chaque mot)
+    state: Optional[Tuple[int, List[int], List[str], List[str], List[int], List[str], List[int]]]
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.state = None
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Passe en minuscules, retire les accents et remplace la ponctuation par des espaces."""
+        text = unicodedata.normalize('NFKD', text.casefold())
+        text = ''.join([c for c in text if not unicodedata.combining(c)])
+
+        return ' '.join(re.split(r'\W+', text)).strip()
+
+    def load(self) -> None:
+        with self.lock:
+            self._load(Setting.get_int('games_catalogue_version'))
+
+    def _load(self, version: int) -> None:
+        games = db.session.execute(
+            sa.select(Game.id, Game.name, Game.popularity).order_by(Game.id)
+        ).all()
+
+        ids = [game.id for game in games]
+        names = [game.name for game in games]
+        normalized_names = [self.normalize(name) for name in names]
+        popularities = [game.popularity for game in games]
+
+        words = sorted(
+            (word, position) for position, name in enumerate(normalized_names) for word in set(name.split())
+        )
+
+        self.state = (
+            version,
+            ids,
+            names,
+            normalized_names,
+            popularities,
+            [word for word, _ in words],
+            [position for _, position in words],
+        )
+
+    def _fresh_state(self) -> Tuple[int, List[int], List[str], List[str], List[int], List[str], List[int]]:
+        version = Setting.get_int('games_catalogue_version')
+        state = self.state
+
+        if state is not None and state[0] == version:
+            return state
+
+        # L'index n'est reconstruit que par un seul thread à la fois, les autres continuant d'utiliser l'ancien entre-temps
+        # (le nouvel état remplaçant l'ancien d'un bloc une fois construit). Seule la première construction est attendue
+        if not self.lock.acquire(blocking=state is None):
+            return state
+
+        try:
+            if self.state is None or self.state[0] != version:
+                self._load(version)
+
+            return self.state
+        finally:
+            self.lock.release()
+
+    def search(self, terms: str, limit: int = 25, exclude: Optional[Set[int]] = None) -> List[Tuple[int, str]]:
+        """Retourne les (ID, nom) des jeux dont le nom contient, pour chaque mot recherché, un mot commençant par celui-ci.
+
+        Les jeux dont le nom commence par la recherche sont classés en premier, puis les plus populaires (les plus notés sur
+        IGDB) et enfin les noms les plus courts."""
+        query = self.normalize(terms)
+        query_words = query.split()
+
+        if not query_words:
+            return []
+
+        _, ids, names, normalized_names, popularities, words, positions = self._fresh_state()
+
+        # Les candidats sont les jeux ayant un mot commençant par le mot recherché le plus long (le plus sélectif)
+        longest = max(query_words, key=len)
+        candidates = set()
+
+        for i in range(bisect_left(words, longest), len(words)):
+            if not words[i].startswith(longest):
+                break
+
+            candidates.add(positions[i])
+
+        matches = (
+            position for position in candidates
+            if (not exclude or ids[position] not in exclude) and all(
+                any(word.startswith(query_word) for word in normalized_names[position].split())
+                for query_word in query_words
+            )
+        )
+
+        return [
+            (ids[position], names[position]) for position in heapq.nsmallest(
+                limit,
+                matches,
+                key=lambda position: (
+                    not normalized_names[position].startswith(query),
+                    -popularities[position],
+                    len(names[position]),
+                    names[position]
+                )
+            )
+        ]
+
+
+settings_cache = SettingsCache()
+game_name_index = GameNameIndex()
+
 
 db.configure_mappers()
@@ -1,18 +1,20 @@
 from hub.forms import LanGamesProposalSearchForm, LanGamesSettingsForm, LanGamesVoteFilterForm, LanAccommodationsSettingsForm, LanAccommodationsVoteFilterForm, LanGamesProposalForm, UserPreferencesForm
-from hub.models import User, Game, LanGameProposal, LanGameProposalVote, VoteType, Setting, LanAccommodationProposal, LanAccommodationProposalVote
-from flask import render_template, redirect, url_for, flash, session, request, g
+from hub.models import User, UserSession, Game, LanGameProposal, LanGameProposalVote, VoteType, VoteFilter, Setting, LanAccommodationProposal, LanAccommodationProposalVote, DiscordOutboxMessage, DiscordOutboxMessageType, game_name_index
+from flask import render_template, redirect, url_for, flash, session, request, g, make_response
 from flask_login import login_required, current_user, logout_user, login_user
 from sqlalchemy_searchable import search, inspect_search_vectors
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func as sa_func
+from typing import Union, Callable, Any
 from werkzeug import Response
 from functools import wraps
-from typing import Union
 from app import app, db
+from pathlib import Path
+from time import time
 import sqlalchemy.orm as sa_orm
 import hub.discord as discord
 import sqlalchemy as sa
+import hashlib
 
 
 def to_home_if_authenticated(f):
@@ -116,6 +118,70 @@ def logout_if_must_relogin(f):
     return decorated
 
 
+def get_deploy_version() -> str:
+    """Identifie la version déployée de l'application, à défaut d'être configurée, à partir de la date de modification et
+    de la taille de ses fichiers (code, gabarits et ressources statiques)."""
+    if app.config['DEPLOY_VERSION']:
+        return app.config['DEPLOY_VERSION']
+
+    digest = hashlib.sha1()
+    root = Path(app.root_path)
+
+    for path in sorted([root / 'app.py', *(root / 'hub').rglob('*.py'), *(root / 'templates').rglob('*'), *(root / 'assets').rglob('*')]):
+        if not path.is_file():
+            continue
+
+        stat = path.stat()
+
+        digest.update(f'{path.relative_to(root)}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+
+    return digest.hexdigest()[:12]
+
+
+DEPLOY_VERSION = get_deploy_version()
+
+
+def conditional(fingerprint: Callable[[], Any]):
+    """Répond 304 si le client possède déjà la version courante de la page, avant d'exécuter la vue.
+
+    L'ETag (faible) est dérivé de l'empreinte retournée par `fingerprint`, de l'utilisateur courant, des statuts des
+    sections, de l'URL (filtres compris) et de la version déployée, afin qu'un déploiement invalide les pages déjà en cache
+    chez les clients."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            # Les messages flash en attente ne sont affichés qu'une fois : la page doit être générée
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+
+            etag = hashlib.sha1(repr((
+                DEPLOY_VERSION,
+                fingerprint(),
+                tuple(getattr(current_user, field) for field in UserSession.FIELDS),
+                g.lan_games_status,
+                g.lan_accommodations_status,
+                request.full_path,
+            )).encode()).hexdigest()
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+
+            return response
+
+        return decorated
+
+    return decorator
+
+
 @app.route('/connexion')
 @to_home_if_authenticated
 def login() -> Union[str, Response]:
@@ -199,6 +265,8 @@ def login_callback() -> Union[str, Response]:
     elif user_avatar_hash:
         user.avatar_url = f'https://cdn.discordapp.com/avatars/{discord_id}/{user_avatar_hash}.png'
 
+    lan_participant_changed = user.is_lan_participant != is_lan_participant
+
     user.is_member = is_member
     user.is_lan_participant = is_lan_participant
     user.is_lan_organizer = is_lan_organizer
@@ -208,6 +276,11 @@ def login_callback() -> Union[str, Response]:
     db.session.add(user)
     db.session.commit()
 
+    UserSession.forget(user.id)
+
+    if lan_participant_changed:
+        LanGameProposal.forget_top()
+
     session.pop('oauth2_state', None)
 
     if not has_any_role:
@@ -243,14 +316,18 @@ def home() -> str:
 @login_required
 @logout_if_must_relogin
 def user_preferences() -> Union[str, Response]:
-    form = UserPreferencesForm(obj=current_user)
+    user = current_user.model
+
+    form = UserPreferencesForm(obj=user)
 
     if form.validate_on_submit():
-        form.populate_obj(current_user)
+        form.populate_obj(user)
 
-        db.session.add(current_user)
+        db.session.add(user)
         db.session.commit()
 
+        UserSession.forget(user.id)
+
         flash('Tes préférences ont été enregistrées.', 'success')
 
         return redirect(url_for('user_preferences'))
@@ -265,65 +342,29 @@ def user_preferences() -> Union[str, Response]:
 @login_required
 @logout_if_must_relogin
 @to_home_if_not_lan_participant
+@conditional(LanGameProposal.state_fingerprint)
 def lan_games_vote() -> Union[str, Response]:
     form = LanGamesVoteFilterForm(request.args, meta={'csrf': False})
     validated = len(request.args) > 0 and form.validate()
 
-    proposals = db.session.execute(
-        sa.select(LanGameProposal)
+    tallies = LanGameProposal.tally(
+        LanGameProposal.tally_query(
+            current_user,
+            voters=User.is_lan_participant == True,
+            filter_=VoteFilter(form.filter.data) if validated and form.filter.data else None,
+            with_voters=True
+        )
         .options(
             sa_orm.selectinload(LanGameProposal.game),
-            sa_orm.selectinload(LanGameProposal.user),
-            sa_orm.selectinload(LanGameProposal.votes)
+            sa_orm.selectinload(LanGameProposal.user).load_only(User.display_name, User.avatar_url)
         )
-    ).scalars().all()
-
-    lan_participants_count = db.session.execute(
-        sa.select(sa_func.count('*')).select_from(User)
-        .where(User.is_lan_participant == True)
-    ).scalar()
-
-    if validated and form.filter.data:
-        def _voted(proposal: LanGameProposal) -> bool:
-            return current_user.id in [
-                vote.user_id for vote in proposal.votes
-            ]
-
-        def _not_voted(proposal: LanGameProposal) -> bool:
-            return not _voted(proposal)
-
-        def _all_voted(proposal: LanGameProposal) -> bool:
-            return len(proposal.votes) == lan_participants_count
-
-        def _not_all_voted(proposal: LanGameProposal) -> bool:
-            return not _all_voted(proposal)
-
-        filter_func = None
-
-        if form.filter.data == 'voted':
-            filter_func = _voted
-        elif form.filter.data == 'not-voted':
-            filter_func = _not_voted
-        elif form.filter.data == 'all-voted':
-            filter_func = _all_voted
-        elif form.filter.data == 'not-all-voted':
-            filter_func = _not_all_voted
-
-        if filter_func:
-            proposals = [
-                proposal for proposal in proposals if filter_func(proposal)
-            ]
-
-    for proposal in proposals:
-        proposal.is_essential = proposal.votes_count(VoteType.YES) == lan_participants_count
-
-    proposals.sort(key=lambda p: p.score, reverse=True)
+    )
 
     return render_template(
         'lan/games/vote.html',
         form=form,
         validated=validated,
-        proposals=proposals,
+        tallies=tallies,
         VoteType=VoteType
     )
 
@@ -339,8 +380,12 @@ def lan_games_proposal_vote(game_id: int, vote_type: str) -> Response:
     try:
         LanGameProposalVote.vote(current_user, game_id, VoteType(vote_type))
 
+        discord.refresh_game_proposal_votes(game_id)
+
         db.session.commit()
 
+        LanGameProposal.forget_top()
+
         anchor = f'g={game_id}'
     except IntegrityError:
         flash('Identifiant de jeu invalide.', 'error')
@@ -359,12 +404,30 @@ def lan_games_proposal() -> Union[str, Response]:
 
     games = []
 
-    if validated:
+    if validated and app.config['GAME_NAME_INDEX_ENABLED']:
+        game_ids = [
+            game_id for game_id, _ in game_name_index.search(form.terms.data, 24)
+        ]
+
+        games = {
+            game.id: game for game in db.session.execute(
+                sa.select(Game)
+                .where(Game.id.in_(game_ids))
+                .options(
+                    sa_orm.selectinload(Game.proposal).selectinload(LanGameProposal.user).load_only(User.display_name, User.avatar_url)
+                )
+            ).scalars().all()
+        }
+
+        games = [
+            games[game_id] for game_id in game_ids if game_id in games
+        ]
+    elif validated:
         games = db.session.execute(
             search(
                 sa.select(Game)
                 .options(
-                    sa_orm.selectinload(Game.proposal).selectinload(LanGameProposal.user)
+                    sa_orm.selectinload(Game.proposal).selectinload(LanGameProposal.user).load_only(User.display_name, User.avatar_url)
                 )
                 .limit(24)
                 .order_by(
@@ -402,12 +465,13 @@ def lan_games_proposal_submit(game_id: int) -> Response:
 
         LanGameProposalVote.vote(current_user, game_id, VoteType.YES)
 
+        if discord.can_send_lan_messages():
+            DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.GAME_PROPOSAL, game_id)
+
         db.session.commit()
 
-        if discord.can_send_lan_messages():
-            discord.send_game_proposal_message(
-                db.session.get(LanGameProposal, game_id)
-            )
+        LanGameProposal.forget_game_ids()
+        LanGameProposal.forget_top()
 
         anchor = f'g={game_id}'
 
@@ -422,61 +486,28 @@ def lan_games_proposal_submit(game_id: int) -> Response:
 @login_required
 @logout_if_must_relogin
 @to_home_if_not_lan_organizer
+@conditional(LanAccommodationProposal.state_fingerprint)
 def lan_accommodations_vote() -> Union[str, Response]:
     form = LanAccommodationsVoteFilterForm(request.args, meta={'csrf': False})
     validated = len(request.args) > 0 and form.validate()
 
-    proposals = db.session.execute(
-        sa.select(LanAccommodationProposal)
+    tallies = LanAccommodationProposal.tally(
+        LanAccommodationProposal.tally_query(
+            current_user,
+            voters=User.is_lan_organizer == True,
+            filter_=VoteFilter(form.filter.data) if validated and form.filter.data else None,
+            with_voters=True
+        )
         .options(
-            sa_orm.selectinload(LanAccommodationProposal.user),
-            sa_orm.selectinload(LanAccommodationProposal.votes)
+            sa_orm.selectinload(LanAccommodationProposal.user).load_only(User.display_name, User.avatar_url)
         )
-    ).scalars().all()
-
-    lan_organizers_count = db.session.execute(
-        sa.select(sa_func.count('*')).select_from(User)
-        .where(User.is_lan_organizer == True)
-    ).scalar()
-
-    if validated and form.filter.data:
-        def _voted(proposal: LanAccommodationProposal) -> bool:
-            return current_user.id in [
-                vote.user_id for vote in proposal.votes
-            ]
-
-        def _not_voted(proposal: LanAccommodationProposal) -> bool:
-            return not _voted(proposal)
-
-        def _all_voted(proposal: LanAccommodationProposal) -> bool:
-            return len(proposal.votes) == lan_organizers_count
-
-        def _not_all_voted(proposal: LanAccommodationProposal) -> bool:
-            return not _all_voted(proposal)
-
-        filter_func = None
-
-        if form.filter.data == 'voted':
-            filter_func = _voted
-        elif form.filter.data == 'not-voted':
-            filter_func = _not_voted
-        elif form.filter.data == 'all-voted':
-            filter_func = _all_voted
-        elif form.filter.data == 'not-all-voted':
-            filter_func = _not_all_voted
-
-        if filter_func:
-            proposals = [
-                proposal for proposal in proposals if filter_func(proposal)
-            ]
-
-    proposals.sort(key=lambda p: p.score, reverse=True)
+    )
 
     return render_template(
         'lan/accommodations/vote.html',
         form=form,
         validated=validated,
-        proposals=proposals,
+        tallies=tallies,
         VoteType=VoteType
     )
 
@@ -517,14 +548,15 @@ def lan_accommodations_proposal() -> Union[str, Response]:
 
         db.session.add(lan_accommodation_proposal)
 
-        db.session.commit()
+        # La proposition, le vote de son auteur et le message Discord sont enregistrés dans la même transaction
+        db.session.flush()
 
         LanAccommodationProposalVote.vote(current_user, lan_accommodation_proposal.id, VoteType.YES)
 
-        db.session.commit()
-
         if discord.can_send_organizer_messages():
-            discord.send_accommodation_proposal_message(lan_accommodation_proposal)
+            DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.ACCOMMODATION_PROPOSAL, lan_accommodation_proposal.id)
+
+        db.session.commit()
 
         flash('Merci pour ta proposition !', 'success')
 
@@ -551,13 +583,11 @@ def lan_accommodations_proposal_edit(accommodation_proposal_id: int) -> Union[st
 
         db.session.add(lan_accommodation_proposal)
 
-        modified = db.session.is_modified(lan_accommodation_proposal)
+        if db.session.is_modified(lan_accommodation_proposal) and discord.can_send_organizer_messages():
+            DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.ACCOMMODATION_PROPOSAL, lan_accommodation_proposal.id)
 
         db.session.commit()
 
-        if modified and discord.can_send_organizer_messages():
-            discord.send_accommodation_proposal_message(lan_accommodation_proposal)
-
         flash('Proposition mise à jour.', 'success')
 
         return redirect(url_for('lan_accommodations_vote', _anchor=f'a={lan_accommodation_proposal.id}'))
@@ -598,6 +628,10 @@ def admin_user_delete(user_id: int) -> Response:
 
         db.session.commit()
 
+        UserSession.forget(user_id)
+        LanGameProposal.forget_game_ids()
+        LanGameProposal.forget_top()
+
         if result.rowcount == 1:
             flash('Utilisateur supprimé.', 'success')
         else:
@@ -617,6 +651,8 @@ def admin_user_force_relogin(user_id: int) -> Response:
 
     db.session.commit()
 
+    UserSession.forget(user_id)
+
     if result.rowcount == 1:
         flash('Utilisateur forcé à se reconnecté.', 'success')
     else:
@@ -630,13 +666,16 @@ def admin_user_force_relogin(user_id: int) -> Response:
 @logout_if_must_relogin
 @to_home_if_not_admin
 def admin_users_lan_participants_force_relogin() -> Response:
-    result = db.session.execute(
-        sa.update(User).where(User.is_lan_participant == True).values(must_relogin=True, is_lan_participant=False)
-    )
+    user_ids = db.session.execute(
+        sa.update(User).where(User.is_lan_participant == True).values(must_relogin=True, is_lan_participant=False).returning(User.id)
+    ).scalars().all()
 
     db.session.commit()
 
-    if result.rowcount >= 1:
+    UserSession.forget(*user_ids)
+    LanGameProposal.forget_top()
+
+    if user_ids:
         flash('Participants à la LAN forcés à se reconnecter.', 'success')
     else:
         flash('Aucun participant à la LAN à forcer à se reconnecter.', 'error')
@@ -649,13 +688,16 @@ def admin_users_lan_participants_force_relogin() -> Response:
 @logout_if_must_relogin
 @to_home_if_not_admin
 def admin_users_force_relogin() -> Response:
-    result = db.session.execute(
-        sa.update(User).values(must_relogin=True, is_lan_organizer=False, is_lan_participant=False)
-    )
+    user_ids = db.session.execute(
+        sa.update(User).values(must_relogin=True, is_lan_organizer=False, is_lan_participant=False).returning(User.id)
+    ).scalars().all()
 
     db.session.commit()
 
-    if result.rowcount >= 1:
+    UserSession.forget(*user_ids)
+    LanGameProposal.forget_top()
+
+    if user_ids:
         flash('Tous les utilisateurs ont forcés à se reconnecter.', 'success')
     else:
         flash('Aucun utilisateur à forcer à se reconnecter.', 'error')
@@ -668,13 +710,15 @@ def admin_users_force_relogin() -> Response:
 @logout_if_must_relogin
 @to_home_if_not_admin
 def admin_users_lan_organizers_force_relogin() -> Response:
-    result = db.session.execute(
-        sa.update(User).where(User.is_lan_organizer == True).values(must_relogin=True, is_lan_organizer=False)
-    )
+    user_ids = db.session.execute(
+        sa.update(User).where(User.is_lan_organizer == True).values(must_relogin=True, is_lan_organizer=False).returning(User.id)
+    ).scalars().all()
 
     db.session.commit()
 
-    if result.rowcount >= 1:
+    UserSession.forget(*user_ids)
+
+    if user_ids:
         flash('Organisateurs de la LAN forcés à se reconnecter.', 'success')
     else:
         flash('Aucun organisateur de la LAN à forcer à se reconnecter.', 'error')
@@ -686,12 +730,17 @@ def admin_users_lan_organizers_force_relogin() -> Response:
 @login_required
 @logout_if_must_relogin
 @to_home_if_not_admin
+@conditional(lambda: (
+    LanGameProposal.state_fingerprint(),
+    # Renouvelle régulièrement la page afin que le jeton CSRF du formulaire n'expire pas
+    int(time() // ((app.config.get('WTF_CSRF_TIME_LIMIT') or 3600) / 2)),
+))
 def admin_lan_games() -> Union[str, Response]:
     proposals = db.session.execute(
         sa.select(LanGameProposal)
         .options(
             sa_orm.selectinload(LanGameProposal.game),
-            sa_orm.selectinload(LanGameProposal.user)
+            sa_orm.selectinload(LanGameProposal.user).load_only(User.display_name, User.avatar_url)
         )
     ).scalars().all()
 
@@ -725,9 +774,11 @@ def admin_lan_games_proposal_resend(game_id: int) -> Response:
     game_proposal = db.get_or_404(LanGameProposal, game_id)
 
     if discord.can_send_lan_messages():
-        discord.send_game_proposal_message(game_proposal)
+        DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.GAME_PROPOSAL, game_proposal.game_id)
 
-        flash('C\'est renvoyé.', 'success')
+        db.session.commit()
+
+        flash('Le message sera renvoyé d\'ici quelques instants.', 'success')
     else:
         flash('Impossible d\'envoyer des messages sur Discord.', 'error')
 
@@ -745,6 +796,9 @@ def admin_lan_game_proposal_delete(game_id: int) -> Response:
 
     db.session.commit()
 
+    LanGameProposal.forget_game_ids()
+    LanGameProposal.forget_top()
+
     if result.rowcount == 1:
         flash('Proposition supprimée.', 'success')
     else:
@@ -762,8 +816,12 @@ def admin_lan_game_proposal_delete_votes(game_id: int) -> Response:
         sa.delete(LanGameProposalVote).where(LanGameProposalVote.game_proposal_game_id == game_id)
     )
 
+    discord.refresh_game_proposal_votes(game_id)
+
     db.session.commit()
 
+    LanGameProposal.forget_top()
+
     if result.rowcount >= 1:
         flash('Votes supprimés.', 'success')
     else:
@@ -783,6 +841,9 @@ def admin_lan_game_proposals_reset_all() -> Response:
 
     db.session.commit()
 
+    LanGameProposal.forget_game_ids()
+    LanGameProposal.forget_top()
+
     flash('Propositions et votes réinitialisés.', 'success')
 
     return redirect(url_for('admin_lan_games'))
@@ -797,8 +858,13 @@ def admin_lan_game_proposals_reset_votes() -> Response:
         sa.delete(LanGameProposalVote)
     )
 
+    for game_id in db.session.execute(sa.select(LanGameProposal.game_id).where(LanGameProposal.message_id != None)).scalars().all():
+        discord.refresh_game_proposal_votes(game_id)
+
     db.session.commit()
 
+    LanGameProposal.forget_top()
+
     flash('Votes réinitialisés.', 'success')
 
     return redirect(url_for('admin_lan_games'))
@@ -812,7 +878,7 @@ def admin_lan_accommodations() -> Union[str, Response]:
     proposals = db.session.execute(
         sa.select(LanAccommodationProposal)
         .options(
-            sa_orm.selectinload(LanAccommodationProposal.user)
+            sa_orm.selectinload(LanAccommodationProposal.user).load_only(User.display_name, User.avatar_url)
         )
         .order_by(LanAccommodationProposal.title)
     ).scalars().all()
@@ -845,9 +911,11 @@ def admin_lan_accommodation_proposal_resend(accommodation_proposal_id: int) -> R
     accommodation_proposal = db.get_or_404(LanAccommodationProposal, accommodation_proposal_id)
 
     if discord.can_send_organizer_messages():
-        discord.send_accommodation_proposal_message(accommodation_proposal)
+        DiscordOutboxMessage.enqueue(DiscordOutboxMessageType.ACCOMMODATION_PROPOSAL, accommodation_proposal.id)
+
+        db.session.commit()
 
-        flash('C\'est renvoyé.', 'success')
+        flash('Le message sera renvoyé d\'ici quelques instants.', 'success')
     else:
         flash('Impossible d\'envoyer des messages sur Discord.', 'error')
 
@@ -930,7 +998,12 @@ def admin_lan_accommodation_proposals_reset_votes() -> Response:
 @to_home_if_not_lan_organizer
 def admin_lan_preferences() -> Union[str, Response]:
     users = db.session.execute(
-        sa.select(User).where(User.is_lan_participant == True).order_by(User.display_name.asc())
+        sa.select(User)
+        .options(
+            sa_orm.undefer_group('preferences')
+        )
+        .where(User.is_lan_participant == True)
+        .order_by(User.display_name.asc())
     ).scalars().all()
 
     return render_template(
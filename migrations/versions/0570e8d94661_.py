@@ -0,0 +1,109 @@
+"""empty message
+
+Revision ID: 0570e8d94661
+Revises: c547abec2d5f
+Create Date: 2026-10-18 13:28:08.309322
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0570e8d94661'
+down_revision = 'c547abec2d5f'
+branch_labels = None
+depends_on = None
+
+VOTABLE_TABLES = (
+    # (table des propositions, clé primaire, table des votes, clé étrangère vers la proposition)
+    ('lan_game_proposals', 'game_id', 'lan_game_proposal_votes', 'game_proposal_game_id'),
+    ('lan_accommodation_proposals', 'id', 'lan_accommodation_proposal_votes', 'accommodation_proposal_id'),
+)
+
+
+def sync_votes_count_trigger(proposals_table: str, proposals_pk: str, votes_table: str, votes_fk: str) -> None:
+    op.execute(f'''
+CREATE OR REPLACE FUNCTION {proposals_table}_refresh_votes_count(proposal_id bigint) RETURNS void AS $$
+BEGIN
+    -- La proposition est verrouillée avant le décompte : celui-ci, effectué par une nouvelle requête (et donc un nouvel
+    -- instantané), prend ainsi en compte les votes des transactions concurrentes validées entre-temps
+    PERFORM 1 FROM {proposals_table} WHERE {proposals_pk} = proposal_id FOR UPDATE;
+
+    UPDATE {proposals_table} SET
+        yes_count = c.yes_count,
+        neutral_count = c.neutral_count,
+        no_count = c.no_count,
+        score = c.yes_count * 2 + c.neutral_count - c.no_count
+    FROM (
+        SELECT
+            count(*) FILTER (WHERE type = 'YES') AS yes_count,
+            count(*) FILTER (WHERE type = 'NEUTRAL') AS neutral_count,
+            count(*) FILTER (WHERE type = 'NO') AS no_count
+        FROM {votes_table}
+        WHERE {votes_fk} = proposal_id
+    ) AS c
+    WHERE {proposals_table}.{proposals_pk} = proposal_id;
+END;
+$$ LANGUAGE plpgsql;
+''')
+
+    op.execute(f'''
+CREATE OR REPLACE FUNCTION {votes_table}_votes_count_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM {proposals_table}_refresh_votes_count(NEW.{votes_fk});
+    END IF;
+
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.{votes_fk} <> NEW.{votes_fk}) THEN
+        PERFORM {proposals_table}_refresh_votes_count(OLD.{votes_fk});
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+''')
+
+    op.execute(f'''
+CREATE TRIGGER {votes_table}_votes_count_trigger
+    AFTER INSERT OR UPDATE OF type, {votes_fk} OR DELETE ON {votes_table}
+    FOR EACH ROW EXECUTE FUNCTION {votes_table}_votes_count_trigger();
+''')
+
+    op.execute(f'SELECT {proposals_table}_refresh_votes_count({proposals_pk}) FROM {proposals_table};')
+
+
+def drop_votes_count_trigger(proposals_table: str, votes_table: str) -> None:
+    op.execute(f'DROP TRIGGER IF EXISTS {votes_table}_votes_count_trigger ON {votes_table};')
+    op.execute(f'DROP FUNCTION IF EXISTS {votes_table}_votes_count_trigger();')
+    op.execute(f'DROP FUNCTION IF EXISTS {proposals_table}_refresh_votes_count(bigint);')
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    for proposals_table, proposals_pk, votes_table, votes_fk in VOTABLE_TABLES:
+        with op.batch_alter_table(proposals_table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('yes_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+            batch_op.add_column(sa.Column('neutral_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+            batch_op.add_column(sa.Column('no_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+            batch_op.add_column(sa.Column('score', sa.Integer(), server_default=sa.text('0'), nullable=False))
+            batch_op.create_index(batch_op.f(f'ix_{proposals_table}_score'), ['score'], unique=False)
+
+        sync_votes_count_trigger(proposals_table, proposals_pk, votes_table, votes_fk)
+
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    for proposals_table, proposals_pk, votes_table, votes_fk in reversed(VOTABLE_TABLES):
+        drop_votes_count_trigger(proposals_table, votes_table)
+
+        with op.batch_alter_table(proposals_table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{proposals_table}_score'))
+            batch_op.drop_column('score')
+            batch_op.drop_column('no_count')
+            batch_op.drop_column('neutral_count')
+            batch_op.drop_column('yes_count')
+
+    # ### end Alembic commands ###
@@ -0,0 +1,66 @@
+"""empty message
+
+Revision ID: f7a3d9e2b614
+Revises: c52e7a9d4f18
+Create Date: 2026-10-20 09:42:17.530128
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a3d9e2b614'
+down_revision = 'c52e7a9d4f18'
+branch_labels = None
+depends_on = None
+
+VOTABLE_TABLES = (
+    # (table des propositions, clé primaire, table des votes, clé étrangère vers la proposition)
+    ('lan_game_proposals', 'game_id', 'lan_game_proposal_votes', 'game_proposal_game_id'),
+    ('lan_accommodation_proposals', 'id', 'lan_accommodation_proposal_votes', 'accommodation_proposal_id'),
+)
+
+
+def replace_refresh_votes_count(proposals_table: str, proposals_pk: str, votes_table: str, votes_fk: str, with_lock: bool) -> None:
+    lock = f'''
+    -- La proposition est verrouillée avant le décompte : celui-ci, effectué par une nouvelle requête (et donc un nouvel
+    -- instantané), prend ainsi en compte les votes des transactions concurrentes validées entre-temps
+    PERFORM 1 FROM {proposals_table} WHERE {proposals_pk} = proposal_id FOR UPDATE;
+''' if with_lock else ''
+
+    op.execute(f'''
+CREATE OR REPLACE FUNCTION {proposals_table}_refresh_votes_count(proposal_id bigint) RETURNS void AS $$
+BEGIN{lock}
+    UPDATE {proposals_table} SET
+        yes_count = c.yes_count,
+        neutral_count = c.neutral_count,
+        no_count = c.no_count,
+        score = c.yes_count * 2 + c.neutral_count - c.no_count,
+        votes_version = votes_version + 1
+    FROM (
+        SELECT
+            count(*) FILTER (WHERE type = 'YES') AS yes_count,
+            count(*) FILTER (WHERE type = 'NEUTRAL') AS neutral_count,
+            count(*) FILTER (WHERE type = 'NO') AS no_count
+        FROM {votes_table}
+        WHERE {votes_fk} = proposal_id
+    ) AS c
+    WHERE {proposals_table}.{proposals_pk} = proposal_id;
+END;
+$$ LANGUAGE plpgsql;
+''')
+
+    # Rattrape les décomptes éventuellement faussés par des votes concurrents avant ce correctif
+    if with_lock:
+        op.execute(f'SELECT {proposals_table}_refresh_votes_count({proposals_pk}) FROM {proposals_table};')
+
+
+def upgrade():
+    for proposals_table, proposals_pk, votes_table, votes_fk in VOTABLE_TABLES:
+        replace_refresh_votes_count(proposals_table, proposals_pk, votes_table, votes_fk, with_lock=True)
+
+
+def downgrade():
+    for proposals_table, proposals_pk, votes_table, votes_fk in reversed(VOTABLE_TABLES):
+        replace_refresh_votes_count(proposals_table, proposals_pk, votes_table, votes_fk, with_lock=False)
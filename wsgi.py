@@ -1 +1,21 @@
-from app import app as application
+from sqlalchemy.exc import SQLAlchemyError
+from app import app as application, db
+from hub.models import settings_cache, game_name_index
+
+# Pré-chargement des paramètres dans le cache local au worker
+with application.app_context():
+    try:
+        settings_cache.load()
+    except SQLAlchemyError as e:
+        application.logger.warning(f'Impossible de pré-charger les paramètres : {e}')
+
+    # Construction de l'index des noms de jeux, s'il est activé
+    if application.config['GAME_NAME_INDEX_ENABLED']:
+        try:
+            game_name_index.load()
+        except SQLAlchemyError as e:
+            application.logger.warning(f'Impossible de construire l\'index des noms de jeux : {e}')
+
+    # Le pré-chargement a lieu dans le processus maître avant le fork des workers : les connexions ouvertes ne doivent pas
+    # être partagées entre eux, chacun ouvrira les siennes
+    db.engine.dispose()